@@ -0,0 +1,85 @@
+#! /usr/bin/python3
+"""
+HAL links benchmark
+
+Builds the self link of every item of a page, as App.action does for
+"_embedded" items, with the former regular expression walk over the uris of
+the model and with the LinkTemplate compiled by set_model, and prints
+microseconds per page as json.
+
+Usage: python benchmarks/hal_bench.py [--items 50,500] [--rounds 200]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zrest.router import LinkTemplate
+
+_params_searcher = re.compile(r"<(?P<param>[\w]*)>")
+URIS = [r"^/invoices/<_id>$",
+        r"^/customers/<customers_dni>/invoices/<_id>$"]
+
+
+def page(items):
+    return [{"_id": index, "cliente": index % 97, "importe": "{}.25".format(index)}
+            for index in range(1, items+1)]
+
+
+def regex_links(items, name="invoices"):
+    for item in items:
+        links = dict()
+        for uri in URIS:
+            s_params = _params_searcher.findall(uri)
+            for param in s_params:
+                if param.startswith("<"+name+"_"):
+                    s_param = "<"+param[len("<"+name+"_"):]
+                else:
+                    s_param = param
+                if s_param in uri and s_param in item:
+                    uri = uri.replace("<"+param+">", str(item[s_param]))
+                    links["self"] = {"href": uri.strip("^").strip("$")}
+                    item["_links"] = links
+
+
+def template_links(items, templates):
+    for item in items:
+        for template in templates:
+            href = template.expand(item)
+            if href is not None:
+                item["_links"] = {"self": {"href": href}}
+                break
+
+
+def bench(function, items, rounds, *args):
+    data = page(items)
+    start = time.perf_counter()
+    for x in range(0, rounds):
+        function(data, *args)
+    return (time.perf_counter() - start) / rounds * 1e6, data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", default="50,500")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    templates = [LinkTemplate(uri) for uri in reversed(URIS)]
+    results = list()
+    for items in [int(item) for item in args.items.split(",")]:
+        regex, regex_data = bench(regex_links, items, args.rounds)
+        template, template_data = bench(template_links, items, args.rounds, templates)
+        assert regex_data == template_data
+        results.append({"items": items,
+                        "us_per_page_regex": round(regex, 1),
+                        "us_per_page_template": round(template, 1),
+                        "speedup": round(regex / template, 2)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#! /usr/bin/python3
+"""
+HTTP benchmark
+
+Starts an App in a separate process on localhost, with a ShelveModel of
+customers, a ShelveModel of invoices, a ShelveForeign of the invoices of
+each customer and a ShelveBlocking, all of them seeded with synthetic data.
+Then drives a mixed workload of GET, POST, PATCH, DELETE and NEXT requests
+from concurrent keep-alive connections and prints throughput and latency
+percentiles, overall and by verb, as json.
+
+Usage: python benchmarks/http_bench.py [--requests 2000] [--concurrency 8]
+                                       [--mix GET:60,POST:10,PATCH:15,DELETE:5,NEXT:10]
+                                       [--records 1000] [--workers 1] [--pool-size N]
+                                       [--engine threads|async]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def serve(args):
+    """
+    Builds the App, seeds its models and runs it. Prints "ready" once it is
+    listening.
+
+    """
+    from zrest.server import App, NEXT
+    from zrest.datamodels.shelvemodels import ShelveModel, ShelveForeign, ShelveBlocking
+    app = App()
+    customers = ShelveModel(os.path.join(args.path, "customers"), args.groups,
+                            index_fields=["nombre", "dni"],
+                            headers=["nombre", "dni"])
+    invoices = ShelveModel(os.path.join(args.path, "invoices"), args.groups,
+                           index_fields=["cliente", "fecha", "importe"],
+                           headers=["cliente", "fecha", "importe"])
+    blocking = ShelveBlocking(os.path.join(args.path, "blocking"),
+                              index_fields=["cliente"],
+                              headers=["cliente", "importe"])
+    app.set_model(customers, "customers", "^/customers/<dni>$")
+    app.set_model(invoices, "invoices", "^/invoices/<_id>$")
+    app.set_model(ShelveForeign(customers, invoices, "cliente"),
+                  "customers/invoices",
+                  "^/customers/<customers_dni>/invoices/<invoices__id>$")
+    app.set_model(blocking, "blocking", "^/blocking/<_id>$")
+    app.set_method("blocking", "^/blocking/<_id>$", NEXT)
+    customers_count = max(1, args.records // 10)
+    customers.insert([{"nombre": "Customer {}".format(index), "dni": dni(index)}
+                      for index in range(0, customers_count)])
+    invoices.insert([invoice(index, customers_count) for index in range(0, args.records)])
+    blocking.insert([{"cliente": index % customers_count, "importe": "1.00"}
+                     for index in range(0, args.records)])
+    print("ready", flush=True)
+    if args.engine == "async":
+        app.run_async("127.0.0.1", args.port)
+    else:
+        app.run("127.0.0.1", args.port, workers=args.workers, pool_size=args.pool_size)
+
+
+def dni(index):
+    return "{:08d}X".format(index)
+
+
+def invoice(index, customers_count):
+    return {"cliente": index % customers_count + 1,
+            "fecha": "01/01/2017",
+            "importe": "{}.25".format(index)}
+
+
+class Client:
+    """
+    Keep-alive connection running requests of the workload.
+
+    """
+    def __init__(self, port, number, args):
+        self.port = port
+        self.number = number
+        self.args = args
+        self.random = random.Random(number)
+        self.customers_count = max(1, args.records // 10)
+        self.created = list()
+        self.next_item = None
+        self.connection = None
+
+    def request(self, verb, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if body is not None:
+            body = json.dumps(body).encode("utf-8")
+        for attempt in range(0, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            try:
+                self.connection.request(verb, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.getheader("Connection", "").lower() == "close":
+                self.connection.close()
+                self.connection = None
+            return response.status, data
+
+    def operation(self, verb):
+        """
+        Runs a request of the workload with given verb.
+
+        :returns: tuple with status code and seconds
+
+        """
+        args = self.args
+        start = time.perf_counter()
+        if verb == "GET":
+            kind = self.random.randrange(4)
+            if kind == 0:
+                path = "/customers/{}".format(dni(self.random.randrange(self.customers_count)))
+            elif kind == 1:
+                path = "/invoices/{}".format(self.random.randrange(args.records) + 1)
+            elif kind == 2:
+                path = "/customers/{}/invoices".format(dni(self.random.randrange(self.customers_count)))
+            else:
+                path = "/invoices?page={}".format(self.random.randrange(max(1, args.records // 50)) + 1)
+            status, data = self.request("GET", path)
+        elif verb == "POST" or (verb == "DELETE" and not self.created):
+            status, data = self.request("POST", "/invoices",
+                                        invoice(self.random.randrange(args.records), self.customers_count))
+            try:
+                self.created.append(json.loads(data.decode("utf-8"))["_id"])
+            except (ValueError, KeyError, TypeError):
+                pass
+        elif verb == "PATCH":
+            status, data = self.request("PATCH", "/invoices/{}".format(self.random.randrange(args.records) + 1),
+                                        {"importe": "{}.50".format(self.random.randrange(1000))})
+        elif verb == "DELETE":
+            status, data = self.request("DELETE", "/invoices/{}".format(self.created.pop()))
+        elif verb == "NEXT":
+            path = "/blocking/?_blocker=client{}".format(self.number)
+            if self.next_item is not None:
+                path += "&_item={}".format(self.next_item)
+            status, data = self.request("NEXT", path)
+            try:
+                self.next_item = json.loads(data.decode("utf-8"))["_id"] if status == 200 else None
+            except (ValueError, KeyError, TypeError):
+                self.next_item = None
+        else:
+            raise ValueError("Unknown verb {}".format(verb))
+        return status, time.perf_counter() - start
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(ratio * len(values)))]
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    return {"requests": len(latencies),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "max_ms": round(latencies[-1] * 1000, 3) if latencies else None}
+
+
+def drive(port, args, mix):
+    """
+    Runs args.requests requests of the mix from args.concurrency clients,
+    after args.warmup requests which are not measured.
+
+    :returns: dictionary with results
+
+    """
+    verbs = list(itertools.chain(*[[verb] * weight for verb, weight in mix]))
+    warmup = Client(port, args.concurrency, args)
+    for index in range(0, args.warmup):
+        warmup.operation(random.Random(index).choice(verbs))
+    counter = itertools.count()
+    lock = threading.Lock()
+    results = list()  # (verb, status, seconds)
+
+    def worker(number):
+        client = Client(port, number, args)
+        local = list()
+        while next(counter) < args.requests:
+            verb = client.random.choice(verbs)
+            try:
+                status, seconds = client.operation(verb)
+            except (OSError, http.client.HTTPException):
+                status, seconds = 0, 0.0
+            local.append((verb, status, seconds))
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(0, args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    final = {"duration_s": round(duration, 3),
+             "throughput_rps": round(len(results) / duration, 2),
+             "errors": len([item for item in results if item[1] == 0 or item[1] >= 500]),
+             "status": dict()}
+    final.update(summary([item[2] for item in results if item[1]]))
+    for verb, status, seconds in results:
+        final["status"][str(status)] = final["status"].get(str(status), 0) + 1
+    final["by_verb"] = dict([(verb, summary([item[2] for item in results if item[0] == verb and item[1]]))
+                             for verb, weight in mix])
+    return final
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--mix", default="GET:60,POST:10,PATCH:15,DELETE:5,NEXT:10")
+    parser.add_argument("--records", type=int, default=1000, help="invoices seeded")
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=None)
+    parser.add_argument("--engine", choices=("threads", "async"), default="threads")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+    mix = [(item.split(":")[0].upper(), int(item.split(":")[1])) for item in args.mix.split(",")]
+    path = tempfile.mkdtemp(prefix="zrest_http_bench_")
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve",
+               "--path", path, "--port", str(port),
+               "--records", str(args.records), "--groups", str(args.groups),
+               "--workers", str(args.workers), "--engine", args.engine]
+    if args.pool_size is not None:
+        command += ["--pool-size", str(args.pool_size)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, start_new_session=True)
+    try:
+        while server.stdout.readline().strip() != b"ready":
+            if server.poll() is not None:
+                raise RuntimeError("Server exited with status {}".format(server.returncode))
+        # Whatever the server prints has to be read, or it blocks once the pipe is full
+        threading.Thread(target=server.stdout.read, daemon=True).start()
+        for attempt in range(0, 100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        results = {"config": {"requests": args.requests,
+                              "concurrency": args.concurrency,
+                              "mix": dict(mix),
+                              "records": args.records,
+                              "groups": args.groups,
+                              "workers": args.workers,
+                              "pool_size": args.pool_size,
+                              "engine": args.engine,
+                              "python": sys.version.split()[0]}}
+        results.update(drive(port, args, mix))
+        print(json.dumps(results, indent=2))
+    finally:
+        os.killpg(server.pid, 15)
+        server.wait()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
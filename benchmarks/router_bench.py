@@ -0,0 +1,63 @@
+#! /usr/bin/python3
+"""
+Router benchmark
+
+Resolves paths against route tables of growing size, registered the same way
+App.set_model does, and prints microseconds per resolution for the compiled
+router with and without its LRU.
+
+Usage: python benchmarks/router_bench.py [--routes 5,50,500] [--requests 20000]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zrest.router import Router
+
+_params_searcher = re.compile(r"<(?P<param>[\w]*)>")
+
+
+def model_uris(name):
+    uri = "^/{}/<_id>$".format(name)
+    params = _params_searcher.findall(uri)
+    final_uri = uri
+    for param in params:
+        final_uri = final_uri.replace("<{}>".format(param), r"(?P<{}>[\w_]*)?".format(param))
+    list_uri = final_uri.replace("/" + r"(?P<{}>[\w_]*)?".format(params[-1]), "")
+    return [final_uri, list_uri]
+
+
+def bench(routes, requests, cache_size):
+    router = Router(cache_size=cache_size)
+    for index in range(0, routes):
+        for uri in model_uris("model{}".format(index)):
+            router.add(uri)
+    paths = ["/model{}/{}".format(random.randrange(routes), random.randrange(100))
+             for x in range(0, 256)]
+    start = time.perf_counter()
+    for index in range(0, requests):
+        router.resolve(paths[index % len(paths)])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", default="5,50,500")
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    results = list()
+    for routes in [int(item) for item in args.routes.split(",")]:
+        results.append({"routes": routes,
+                        "us_per_resolve": round(bench(routes, args.requests, 1024), 3),
+                        "us_per_resolve_no_cache": round(bench(routes, args.requests, 0), 3)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
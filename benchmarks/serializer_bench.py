@@ -0,0 +1,67 @@
+#! /usr/bin/python3
+"""
+Serializer benchmark
+
+Encodes and decodes HAL pages as App.action builds them, with every
+serializer backend installed, and prints the results as json.
+
+Usage: python benchmarks/serializer_bench.py [--items 50,500] [--rounds 200]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zrest.serializers import SERIALIZERS
+
+
+def page(items):
+    embedded = list()
+    for index in range(1, items+1):
+        embedded.append({"_id": index,
+                         "cliente": index % 97,
+                         "fecha": "01/01/2017",
+                         "importe": "{}.25".format(index),
+                         "timeout": datetime.datetime(2017, 1, 1, 12, 30) + datetime.timedelta(minutes=index),
+                         "_links": {"self": {"href": "/invoices/{}".format(index)}}})
+    links = dict()
+    for name, item in (("first", 1), ("last", 20), ("prev", 1), ("next", 2), ("self", 1)):
+        links[name] = {"href": "/invoices?page={}&items_per_page={}".format(item, items)}
+    return {"_embedded": {"invoices": embedded}, "_links": links}
+
+
+def bench(serializer, data, rounds):
+    start = time.perf_counter()
+    for x in range(0, rounds):
+        encoded = serializer.encode(data)
+    encode = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for x in range(0, rounds):
+        serializer.decode(memoryview(encoded))
+    decode = (time.perf_counter() - start) / rounds
+    return {"encode_us": round(encode * 1e6, 2),
+            "decode_us": round(decode * 1e6, 2),
+            "bytes": len(encoded)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", default="50,500")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    results = list()
+    for items in [int(item) for item in args.items.split(",")]:
+        data = page(items)
+        for name in SERIALIZERS:
+            result = {"serializer": name, "items": items}
+            result.update(bench(SERIALIZERS[name](), data, args.rounds))
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
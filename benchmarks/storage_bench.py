@@ -0,0 +1,119 @@
+#! /usr/bin/python3
+"""
+Storage benchmark
+
+Measures the operations of ShelveModel on stores of growing size, with
+light_index True and False and several amounts of data groups, and prints
+as json, for each combination, the operations per second of each operation
+and the files, directories and bytes the store takes on disk.
+
+Each store is filled by insert, in batches, and then every other operation
+is run a fixed amount of times over it: new, fetch by _id, fetch by an
+indexed field, edit, drop and get_count.
+
+Usage: python benchmarks/storage_bench.py [--sizes 1000,10000,100000,1000000]
+                                          [--light-index true,false]
+                                          [--groups 1,10,100] [--ops 200]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zrest.datamodels.shelvemodels import ShelveModel
+
+CUSTOMERS = 1000 # Values of the indexed field
+
+
+def record(index):
+    return {"cliente": index % CUSTOMERS,
+            "fecha": "01/01/2017",
+            "importe": "{}.25".format(index)}
+
+
+def disk_usage(path):
+    files, directories, size = 0, 0, 0
+    for root, dirs, names in os.walk(path):
+        directories += len(dirs)
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return {"files": files, "directories": directories, "bytes": size}
+
+
+def timed(function, ops):
+    """
+    Runs function ops times, given the number of each run.
+
+    :returns: operations per second
+
+    """
+    start = time.perf_counter()
+    for index in range(0, ops):
+        function(index)
+    return round(ops / (time.perf_counter() - start), 2)
+
+
+def bench(path, size, light_index, groups, ops, batch_size):
+    model = ShelveModel(path, groups,
+                        index_fields=["cliente", "fecha"],
+                        headers=["cliente", "fecha", "importe"],
+                        light_index=light_index)
+    rand = random.Random(size)
+    results = {"size": size,
+               "light_index": light_index,
+               "groups": groups,
+               "ops": ops,
+               "ops_per_s": dict()}
+    start = time.perf_counter()
+    for offset in range(0, size, batch_size):
+        model.insert([record(index) for index in range(offset, min(size, offset + batch_size))])
+    results["ops_per_s"]["insert"] = round(size / (time.perf_counter() - start), 2)
+    ids = list(range(1, size + 1))
+    rand.shuffle(ids)
+    results["ops_per_s"]["new"] = timed(lambda index: model.new(record(size + index)), ops)
+    results["ops_per_s"]["fetch_by_id"] = timed(lambda index: model.fetch({"_id": ids[index % size]}), ops)
+    results["ops_per_s"]["fetch_by_index"] = timed(
+            lambda index: model.fetch({"cliente": rand.randrange(CUSTOMERS)}), ops)
+    results["ops_per_s"]["edit"] = timed(
+            lambda index: model.edit({"_id": ids[index % size]}, {"importe": "{}.50".format(index)}), ops)
+    results["ops_per_s"]["get_count"] = timed(lambda index: model.get_count({}), ops)
+    results["ops_per_s"]["get_count_by_index"] = timed(
+            lambda index: model.get_count({"cliente": rand.randrange(CUSTOMERS)}), ops)
+    drops = ids[-min(ops, size):]
+    results["ops_per_s"]["drop"] = timed(lambda index: model.drop({"_id": drops[index]}), len(drops))
+    results["disk"] = disk_usage(path)
+    model.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--light-index", default="true,false")
+    parser.add_argument("--groups", default="1,10,100")
+    parser.add_argument("--ops", type=int, default=200, help="runs of each operation but insert")
+    parser.add_argument("--batch-size", type=int, default=10000, help="records given to each insert")
+    args = parser.parse_args()
+    results = list()
+    for size in [int(item) for item in args.sizes.split(",")]:
+        for light_index in [item.strip().lower() == "true" for item in args.light_index.split(",")]:
+            for groups in [int(item) for item in args.groups.split(",")]:
+                path = tempfile.mkdtemp(prefix="zrest_storage_bench_")
+                try:
+                    results.append(bench(os.path.join(path, "model"), size, light_index, groups,
+                                         args.ops, args.batch_size))
+                finally:
+                    shutil.rmtree(path, ignore_errors=True)
+                print(json.dumps(results[-1]), file=sys.stderr, flush=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
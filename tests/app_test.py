@@ -5,6 +5,8 @@ import json
 import sys
 import shutil
 import getpass
+import socket
+import threading
 from zrest.server import App
 from zrest.datamodels.shelvemodels import ShelveModel, ShelveForeign
 from urllib import request
@@ -28,6 +30,11 @@ def set_proxies(cls, done=list()): #This is going to be moved, it's useful
 
 #TODO: Implement HAL HATEOAS http://stateless.co/hal_specification.html
 
+class UnversionedModel(ShelveModel):
+    def get_version(self):
+        return None
+
+
 class App_Test_0(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -121,6 +128,74 @@ class App_Test_0(unittest.TestCase):
         self.data3id.update({"_id": 2, "_links": {"self": {"href": "/model1/2"}}})
         self.assertEqual(json.loads(req.text), self.data3id) # Returns the current data
 
+    def test_5_batch(self):
+        req = requests.post("http://localhost:9000/_batch",
+                            json=[{"verb": "POST", "path": "/model1", "body": {"a": 19, "b": 20, "c": 21}},
+                                  {"verb": "PATCH", "path": "/model1?a=19", "body": {"c": 22}},
+                                  {"verb": "GET", "path": "/model1?a=19"},
+                                  {"verb": "GET", "path": "/model1?a=1000"}])
+        self.assertEqual(req.status_code, 200)
+        results = json.loads(req.text)
+        self.assertEqual([result["response"] for result in results], [201, 200, 200, 404])
+        self.assertEqual(results[2]["payload"]["c"], 22)
+        req = requests.post("http://localhost:9000/_batch",
+                            json=[{"verb": "POST", "path": "/model1", "body": "x"},
+                                  {"verb": "PUT", "path": "/model1/1"},
+                                  {"verb": "PUT", "path": "/model1/1"}])
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual([result["response"] for result in json.loads(req.text)], [400, 400, 400])
+        req = requests.post("http://localhost:9000/_batch", json={"verb": "GET"})
+        self.assertEqual(req.status_code, 400)
+
+    def test_6_profiling(self):
+        self.app.set_profiling("secret")
+        req = requests.get("http://localhost:9000/model1", headers={"X-Profile": "secret"})
+        self.assertEqual(req.status_code, 200)
+        profile_id = req.headers["X-Profile-Id"]
+        req = requests.get("http://localhost:9000/_profiles/{}".format(profile_id),
+                           headers={"X-Profile": "secret"})
+        self.assertEqual(json.loads(req.text)["id"], profile_id)
+        self.assertTrue(len(json.loads(req.text)["stats"]) > 0)
+        req = requests.get("http://localhost:9000/_profiles/{}".format(profile_id))
+        self.assertEqual(req.status_code, 404)
+        self.app.set_profiling(None)
+
+    def test_7_tracing(self):
+        req = requests.get("http://localhost:9000/_traces")
+        self.assertEqual(req.status_code, 404)
+        req = requests.get("http://localhost:9000/model1", headers={"X-Trace": "1"})
+        self.assertNotIn("X-Trace-Id", req.headers)
+        self.app.set_tracing(0.0001)
+        req = requests.get("http://localhost:9000/model1", headers={"X-Trace": "1"})
+        trace_id = req.headers["X-Trace-Id"]
+        req = requests.get("http://localhost:9000/_traces")
+        self.assertIn(trace_id, [trace["trace_id"] for trace in json.loads(req.text)["traces"]])
+        self.app.set_tracing(0)
+
+    def test_8_metrics(self):
+        req = requests.get("http://localhost:9000/_metrics")
+        self.assertEqual(req.status_code, 404)
+        self.app.set_metrics_uri()
+        requests.get("http://localhost:9000/model1")
+        req = requests.get("http://localhost:9000/_metrics")
+        self.assertEqual(req.status_code, 200)
+        self.assertIn("zrest_requests_total", req.text)
+        self.app.set_metrics_uri(None)
+
+    def test_9_cache(self):
+        model = UnversionedModel("extrafiles/app_test/model2", 2, index_fields=["a"], headers=["a"])
+        self.app.set_model(model, "model2", "^/model2/<_id>$")
+        self.app.set_cache()
+        try:
+            self.app.action("GET", "/model2?a=1")
+            model.new({"a": 1}) # Not through the app, so only its version would tell
+            self.assertEqual(self.app.action("GET", "/model2?a=1")["payload"]["a"], 1)
+            self.assertEqual(self.app.get_cache_stats()["entries"], 0)
+        finally:
+            self.app.set_cache(None)
+            model.close()
+            shutil.rmtree("extrafiles/app_test/model2")
+
 
 class App_Test_1(unittest.TestCase):
     @classmethod
@@ -235,5 +310,64 @@ class App_Test_1(unittest.TestCase):
         print(req.text)
 
 
+class App_Test_Async(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = App()
+        cls.path = "extrafiles/app_test/async"
+        cls.app.set_model(ShelveModel(cls.path,
+                                      2,
+                                      index_fields=["a", "b", "c"],
+                                      headers=["a", "b", "c"]),
+                          "async",
+                          "^/async/<_id>$",)
+        threading.Thread(target=cls.app.run_async, args=("127.0.0.1", 9002), daemon=True).start()
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.shutdown()
+        time.sleep(0.5)
+        shutil.rmtree(cls.path)
+
+    def connect(self):
+        conn = socket.create_connection(("127.0.0.1", 9002), timeout=5)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_0_expect_continue(self):
+        body = json.dumps({"a": 1, "b": 2, "c": 3}).encode()
+        conn = self.connect()
+        conn.sendall("POST /async HTTP/1.1\r\nHost: localhost\r\n"
+                     "Content-Type: application/json\r\nContent-Length: {}\r\n"
+                     "Expect: 100-continue\r\n\r\n".format(len(body)).encode())
+        self.assertEqual(conn.recv(25), b"HTTP/1.1 100 Continue\r\n\r\n")
+        conn.sendall(body)
+        self.assertTrue(conn.recv(65536).startswith(b"HTTP/1.1 201"))
+
+    def test_1_headers_too_large(self):
+        conn = self.connect()
+        conn.sendall(b"GET /async HTTP/1.1\r\nX-Large: " + b"a"*70000 + b"\r\n\r\n")
+        self.assertTrue(conn.recv(65536).startswith(b"HTTP/1.1 431"))
+
+    def test_2_chunked_load(self):
+        records = b"".join([json.dumps({"a": item, "b": item, "c": item}).encode() + b"\n"
+                            for item in range(1500)])
+        conn = self.connect()
+        conn.sendall(b"LOAD /async HTTP/1.1\r\nHost: localhost\r\n"
+                     b"Content-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n" +
+                     "{:X}\r\n".format(len(records)).encode() + records + b"\r\n")
+        response = bytes()
+        while b'"batch"' not in response: # First ack comes before the upload ends
+            response += conn.recv(65536)
+        self.assertTrue(response.startswith(b"HTTP/1.1 201"))
+        conn.sendall(b"0\r\n\r\n")
+        while not response.endswith(b"\r\n0\r\n\r\n"):
+            response += conn.recv(65536)
+        self.assertIn(b'"records":1500', response)
+        conn.sendall(b"GET /async?a=1499 HTTP/1.1\r\nHost: localhost\r\n\r\n") # Same connection
+        self.assertTrue(conn.recv(65536).startswith(b"HTTP/1.1 200"))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from zrest.cache import ResponseCache
+
+
+class ResponseCache_Test(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=2, max_bytes=100)
+        self.response = {"response": 0, "headers": {"ETag": '"a-1"'}, "payload": {"a": 1}}
+
+    def test_0_get_put(self):
+        self.assertIsNone(self.cache.get("/model1?"))
+        self.cache.put("/model1?", self.response, {"model1"}, "a-1", 10)
+        self.assertEqual(self.cache.get("/model1?", "a-1"), self.response)
+        self.assertIsNone(self.cache.get("/model1?", "a-2"))
+        self.assertEqual(self.cache.stats["entries"], 0)
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 2)
+
+    def test_1_invalidate(self):
+        self.cache.put("/model1?", self.response, {"model1"}, size=10)
+        self.cache.put("/customers/1/invoices?", self.response, {"customers/invoices", "customers", "invoices"},
+                       size=10)
+        self.cache.invalidate({"invoices"})
+        self.assertIsNotNone(self.cache.get("/model1?"))
+        self.assertIsNone(self.cache.get("/customers/1/invoices?"))
+
+    def test_2_generation(self):
+        generation = self.cache.generation
+        self.cache.invalidate({"model1"})
+        self.cache.put("/model1?", self.response, {"model1"}, size=10, generation=generation)
+        self.assertIsNone(self.cache.get("/model1?"))
+
+    def test_3_bounds(self):
+        for index in range(0, 3):
+            self.cache.put("/model1/{}?".format(index), self.response, {"model1"}, size=10)
+        self.assertEqual(self.cache.stats["entries"], 2)
+        self.assertIsNone(self.cache.get("/model1/0?"))
+        self.cache.put("/model1/big?", self.response, {"model1"}, size=90)
+        self.assertEqual(self.cache.stats["entries"], 2)
+        self.assertEqual(self.cache.stats["bytes"], 100)
+        self.assertEqual(self.cache.stats["evictions"], 2)
+        self.cache.put("/model1/too_big?", self.response, {"model1"}, size=101)
+        self.assertIsNone(self.cache.get("/model1/too_big?"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from zrest.datamodels.idset import IdSet
+
+
+class IdSet_Test(unittest.TestCase):
+    def setUp(self):
+        self.ids = IdSet(range(1, 11))
+
+    def test_0_add(self):
+        self.assertEqual(self.ids.runs, [(1, 11)])
+        self.ids.add(11)
+        self.ids.add("13")
+        self.ids.add(5)
+        self.assertEqual(self.ids.runs, [(1, 12), (13, 14)])
+        self.ids.add(12)
+        self.assertEqual(self.ids.runs, [(1, 14)])
+        self.assertEqual(len(self.ids), 13)
+
+    def test_1_discard(self):
+        self.ids.discard(5)
+        self.ids.discard(1)
+        self.ids.discard(10)
+        self.ids.discard(20)
+        self.assertEqual(self.ids.runs, [(2, 5), (6, 10)])
+        self.assertEqual(len(self.ids), 7)
+        self.assertNotIn(5, self.ids)
+        self.assertIn(6, self.ids)
+        self.assertEqual(list(self.ids), [2, 3, 4, 6, 7, 8, 9])
+
+    def test_2_slice(self):
+        self.ids.discard(3)
+        self.assertEqual(self.ids.slice(0, 3), [1, 2, 4])
+        self.assertEqual(self.ids.slice(2, 5), [4, 5, 6])
+        self.assertEqual(self.ids.slice(8, 50), [10])
+        self.assertEqual(self.ids.slice(50, 100), [])
+
+    def test_3_runs(self):
+        ids = IdSet(["3", 1, "2", 7])
+        self.assertEqual(IdSet(runs=ids.runs), ids)
+        self.assertEqual(len(IdSet(runs=ids.runs)), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from zrest.metrics import Metrics
+
+
+class Metrics_Test(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.1, 1))
+
+    def test_0_record(self):
+        self.metrics.start()
+        self.metrics.set_route(r"^/model1/(?P<_id>[\w_]*)?$")
+        self.metrics.set_route(r"^/model2$")
+        self.metrics.add_phase("model", 0.5)
+        self.metrics.add_phase("model", 0.25)
+        self.metrics.finish("GET", 200)
+        text = self.metrics.render()
+        self.assertIn('zrest_requests_total{route="^/model1/(?P<_id>[\\\\w_]*)?$",verb="GET",status="200"} 1',
+                      text)
+        self.assertIn('zrest_phase_duration_seconds_bucket{route="^/model1/(?P<_id>[\\\\w_]*)?$",verb="GET",'
+                      'phase="model",le="1"} 1', text)
+        self.assertNotIn("model2", text)
+
+    def test_1_without_record(self):
+        self.metrics.add_phase("model", 0.5)
+        self.metrics.finish("GET", 200)
+        self.metrics.start()
+        self.metrics.finish("GET", 404)
+        text = self.metrics.render({"zrest_cache": {"hits": 2, "hit_ratio": 0.5, "name": "cache"}})
+        self.assertIn('zrest_requests_total{route="unmatched",verb="GET",status="404"} 1', text)
+        self.assertNotIn('status="200"', text)
+        self.assertIn("zrest_cache_hits 2", text)
+        self.assertNotIn("zrest_cache_name", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from zrest.router import Router, LinkTemplate
+
+
+class Router_Test(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+        self.router.add(r"^/model1/(?P<_id>[\w_]*)?$")
+        self.router.add(r"^/model1$")
+        self.router.add(r"^/customers/(?P<customers_dni>[\w_]*)?/invoices/(?P<invoices__id>[\w_]*)?$")
+        self.router.add(r"^/customers/(?P<customers_dni>[\w_]*)?/invoices$")
+        self.router.add(r"^/customers/(?P<dni>[\w_]*)?$")
+        self.router.add(r"^/customers$")
+
+    def test_0_resolve(self):
+        self.assertEqual(self.router.resolve("/model1/1"),
+                         (r"^/model1/(?P<_id>[\w_]*)?$", {"_id": "1"}))
+        self.assertEqual(self.router.resolve("/model1"), (r"^/model1$", {}))
+        self.assertEqual(self.router.resolve("/MODEL1"), (r"^/model1$", {}))
+        self.assertIsNone(self.router.resolve("/model2/1"))
+
+    def test_1_priority(self):
+        self.assertEqual(self.router.resolve("/customers/1234/invoices"),
+                         (r"^/customers/(?P<customers_dni>[\w_]*)?/invoices$",
+                          {"customers_dni": "1234"}))
+        self.assertEqual(self.router.resolve("/customers//invoices/2"),
+                         (r"^/customers/(?P<customers_dni>[\w_]*)?/invoices/(?P<invoices__id>[\w_]*)?$",
+                          {"customers_dni": "", "invoices__id": "2"}))
+
+    def test_2_wildcard(self):
+        self.router.add(r"^/(?P<anything>[\w_]*)/info$")
+        self.assertEqual(self.router.resolve("/whatever/info"),
+                         (r"^/(?P<anything>[\w_]*)/info$", {"anything": "whatever"}))
+
+    def test_3_cache(self):
+        uri, groups = self.router.resolve("/model1/1")
+        groups["_id"] = "changed"
+        self.assertEqual(self.router.resolve("/model1/1")[1], {"_id": "1"})
+        router = Router(cache_size=2)
+        router.add(r"^/model1/(?P<_id>[\w_]*)?$")
+        for item in range(0, 5):
+            router.resolve("/model1/{}".format(item))
+        self.assertEqual(len(router._cache), 2)
+        router.add(r"^/model1$")
+        self.assertEqual(len(router._cache), 0)
+
+
+class LinkTemplate_Test(unittest.TestCase):
+    def test_0_expand(self):
+        template = LinkTemplate(r"^/customers/<customers_dni>/invoices/<_id>$")
+        self.assertEqual(template.params, ("customers_dni", "_id"))
+        self.assertEqual(template.expand({"customers_dni": "1234", "_id": 2}), "/customers/1234/invoices/2")
+        self.assertEqual(template.expand({"_id": 2}), "/customers/<customers_dni>/invoices/2")
+        self.assertIsNone(template.expand({"importe": 2}))
+        self.assertIsNone(LinkTemplate(r"^/customers$").expand({"_id": 2}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import datetime
+
+from zrest.serializers import SERIALIZERS, get_serializer
+
+
+class Serializers_Test(unittest.TestCase):
+    def setUp(self):
+        self.data = {"_embedded": {"model1": [{"_id": 1, "a": "ñ", "b": 2.5, "c": None}]},
+                     "_links": {"self": {"href": "/model1?page=1"}}}
+
+    def test_0_roundtrip(self):
+        for name in SERIALIZERS:
+            serializer = get_serializer(name)
+            encoded = serializer.encode(self.data)
+            self.assertTrue(isinstance(encoded, bytes))
+            self.assertEqual(serializer.decode(encoded), self.data)
+            self.assertEqual(serializer.decode(memoryview(encoded)), self.data)
+            self.assertEqual(serializer.decode(bytearray(encoded)), self.data)
+            self.assertEqual(serializer.decode(encoded.decode("utf-8")), self.data)
+
+    def test_1_datetime(self):
+        data = {"timeout": datetime.datetime(2017, 1, 1, 12, 30, 15),
+                "day": datetime.date(2017, 1, 1),
+                "lapse": datetime.timedelta(minutes=25)}
+        for name in SERIALIZERS:
+            self.assertEqual(get_serializer(name).decode(get_serializer(name).encode(data)),
+                             {"timeout": "2017-01-01T12:30:15",
+                              "day": "2017-01-01",
+                              "lapse": 1500.0})
+
+    def test_2_iter_encode(self):
+        data = {"_embedded": {"model1": [{"_id": index, "a": index * 2} for index in range(0, 1000)],
+                              "model2": {"_id": 1}},
+                "_links": {"self": {"href": "/model1?page=1"}}}
+        for name in SERIALIZERS:
+            serializer = get_serializer(name)
+            pieces = list(serializer.iter_encode(data, 1024))
+            self.assertTrue(len(pieces) > 1)
+            self.assertEqual(serializer.decode(b"".join(pieces)), data)
+            self.assertEqual(list(serializer.iter_encode([1, 2])), [serializer.encode([1, 2])])
+
+    def test_3_default(self):
+        self.assertIn(get_serializer().name, SERIALIZERS)
+        with self.assertRaises(KeyError):
+            get_serializer("unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
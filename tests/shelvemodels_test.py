@@ -4,6 +4,8 @@ import time
 import os
 import json
 import shelve
+import dbm
+import importlib
 import glob
 import random
 import sys
@@ -205,5 +207,344 @@ class ShelveModel_Test_2(ShelveModel_Test):
                          [self.data2id])
 
 
+
+class ShelveModel_Test_Reads(unittest.TestCase):
+    """Reads in the threads of callers while the writer writes"""
+    @classmethod
+    def setUpClass(cls):
+        cls.path = r"extrafiles/shelvemodel_reads/"
+        shutil.rmtree(cls.path, True)
+        cls.model = ShelveModel(cls.path, 3, index_fields=["a"], headers=["a", "b"])
+        cls.model.insert([{"a": index % 5, "b": index} for index in range(0, 300)])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.close()
+        shutil.rmtree(cls.path, True)
+
+    def test_0_concurrent_fetch(self):
+        @daemonize
+        def read(number, conn):
+            errors = 0
+            for index in range(0, 50):
+                _id = (number * 50 + index) % 300 + 1
+                fetched = self.model.fetch({"_id": _id})
+                if fetched["data"][0]["b"] != _id - 1:
+                    errors += 1
+            conn.send(errors)
+
+        @daemonize
+        def write(conn):
+            conn.send([self.model.new({"a": 9, "b": index}) for index in range(0, 50)])
+
+        connections = list()
+        for number in range(0, 6):
+            conn_in, conn_out = Pipe(False)
+            connections.append(conn_in)
+            read(number, conn_out)
+        conn_in, conn_out = Pipe(False)
+        write(conn_out)
+        self.assertEqual([conn.recv() for conn in connections], [0 for conn in connections])
+        self.assertEqual(len(conn_in.recv()), 50)
+        self.assertEqual(len(self.model), 350)
+        self.assertEqual(self.model.fetch({"a": 9})["total"], 50)
+        self.assertEqual(self.model.get_count({}), {"count": 350})
+
+    def fork(self, function):
+        conn_in, conn_out = Pipe(False)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                function(conn_out)
+            finally:
+                os._exit(0)
+        return pid, conn_in
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Needs os.fork")
+    def test_1_read_along_other_process(self):
+        def read(conn):
+            self.model.reopen()
+            conn.send(self.model.fetch({"_id": 3})["data"][0]["b"])
+            self.model.close()
+        with self.model._reading():
+            pid, conn = self.fork(read)
+            answered = conn.poll(5)
+            if answered is False:
+                os.kill(pid, 9)
+            os.waitpid(pid, 0)
+        self.assertTrue(answered)
+        self.assertEqual(conn.recv(), 2)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Needs os.fork")
+    def test_2_written_by_other_process_meanwhile(self):
+        def write(conn):
+            self.model.reopen()
+            self.model.new({"a": 7, "b": 7})
+            self.model.close()
+        def get_datafile(filter):
+            del(self.model._get_datafile) # Only along the first attempt
+            pid, conn = self.fork(write)
+            os.waitpid(pid, 0)
+            return self.model._get_datafile(filter)
+        self.model._get_datafile = get_datafile
+        self.assertEqual([item["b"] for item in self.model.fetch({"a": 7})["data"]], [7])
+
+
+
+class ShelveModel_Test_Handles(unittest.TestCase):
+    """Shelves kept open by a model and written by another one"""
+    @classmethod
+    def setUpClass(cls):
+        cls.path = r"extrafiles/shelvemodel_handles/"
+        shutil.rmtree(cls.path, True)
+        cls.model = ShelveModel(cls.path, 2, index_fields=["a"], headers=["a", "b"])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.close()
+        shutil.rmtree(cls.path, True)
+
+    def test_0_written_by_other(self):
+        self.model.new({"a": 1, "b": 1})
+        self.model.new({"a": 1, "b": 2})
+        if dbm.whichdb(os.path.join(self.path, "data_1")) != "dbm.ndbm": # Closed after each session otherwise
+            self.assertIn(os.path.join(self.path, "data_1"), self.model._handles)
+        other = ShelveModel(self.path, 2, index_fields=["a"], headers=["a", "b"])
+        other.edit({"_id": 1}, {"b": 10})
+        other.new({"a": 2, "b": 3})
+        other.close()
+        self.assertEqual(self.model.fetch({"_id": 1})["data"][0]["b"], 10)
+        self.assertEqual([item["b"] for item in self.model.fetch({"a": 2})["data"]], [3])
+        self.model.edit({"_id": 2}, {"b": 20})
+        other = ShelveModel(self.path, 2, index_fields=["a"], headers=["a", "b"])
+        self.assertEqual(other.fetch({"_id": 2})["data"][0]["b"], 20)
+        self.assertEqual(other.fetch({"_id": 1})["data"][0]["b"], 10)
+        other.close()
+
+
+
+class ShelveModel_Test_Legacy_Ids(unittest.TestCase):
+    """Meta saved with a list of ids, as by former versions"""
+    @classmethod
+    def setUpClass(cls):
+        cls.path = r"extrafiles/shelvemodel_legacy_ids/"
+        shutil.rmtree(cls.path, True)
+        model = ShelveModel(cls.path, 2, index_fields=["a"], headers=["a", "b"])
+        model.insert([{"a": index % 2, "b": index} for index in range(0, 4)])
+        model.drop({"_id": 2})
+        model.close()
+        with shelve_open(os.path.join(cls.path, "meta")) as meta:
+            del(meta["id_runs"])
+            meta["ids"] = ["1", "3", "4"]
+        cls.model = ShelveModel(cls.path, 2, index_fields=["a"], headers=["a", "b"])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.close()
+        shutil.rmtree(cls.path, True)
+
+    def test_0_read(self):
+        self.assertEqual(len(self.model), 3)
+        self.assertEqual(sorted([item["_id"] for item in self.model.fetch({})["data"]]), [1, 3, 4])
+        self.assertEqual([item["b"] for item in self.model.fetch({"a": 1})["data"]], [3])
+
+    def test_1_migrated(self):
+        self.model.new({"a": 1, "b": 4})
+        with self.model._reading():
+            self.assertEqual(self.model._counters["ids"].runs, [(1, 2), (3, 6)])
+        with shelve_open(os.path.join(self.path, "meta"), "r") as meta:
+            self.assertEqual(meta["id_runs"], [(1, 2), (3, 6)])
+            self.assertNotIn("ids", meta)
+
+
+
+class ShelveModel_Test_Backends(unittest.TestCase):
+    """Shelves kept open and written by another model, with each dbm backend available"""
+    path = r"extrafiles/shelvemodel_backends/"
+
+    def setUp(self):
+        self.defaultmod, self.modules = dbm._defaultmod, dict(dbm._modules)
+
+    def tearDown(self):
+        dbm._defaultmod, dbm._modules = self.defaultmod, self.modules
+        shutil.rmtree(self.path, True)
+
+    def test_0_written_by_other(self):
+        for name in ("dbm.dumb", "dbm.ndbm", "dbm.gnu"): # Connections of dbm.sqlite3 are not shared by threads
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                continue
+            with self.subTest(backend=name):
+                path = os.path.join(self.path, name) # Locks of each path are kept along the process
+                dbm._defaultmod = module # Backend of new shelves
+                dbm._modules[name] = module
+                model = ShelveModel(path, 2, index_fields=["a"], headers=["a", "b"])
+                try:
+                    model.new({"a": 1, "b": 1})
+                    model.new({"a": 1, "b": 2})
+                    self.assertEqual(dbm.whichdb(os.path.join(path, "data_1")), name)
+                    version = model.get_version()
+                    other = ShelveModel(path, 2, index_fields=["a"], headers=["a", "b"])
+                    other.edit({"_id": 1}, {"b": 10})
+                    other.new({"a": 2, "b": 3})
+                    other.close()
+                    self.assertEqual(model.fetch({"_id": 1})["data"][0]["b"], 10)
+                    self.assertEqual([item["b"] for item in model.fetch({"a": 2})["data"]], [3])
+                    self.assertEqual(len(model), 3)
+                    self.assertNotEqual(model.get_version(), version)
+                finally:
+                    model.close()
+
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "Needs os.fork")
+class ShelveModel_Test_Counters(unittest.TestCase):
+    """Counters kept by the writer and meta written by another process"""
+    @classmethod
+    def setUpClass(cls):
+        cls.path = r"extrafiles/shelvemodel_counters/"
+        shutil.rmtree(cls.path, True)
+        cls.model = ShelveModel(cls.path, 2, index_fields=["a"], headers=["a", "b"])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.close()
+        shutil.rmtree(cls.path, True)
+
+    def fork(self, function):
+        conn_in, conn_out = Pipe(False)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                function(conn_out)
+            finally:
+                os._exit(0)
+        return pid, conn_in
+
+    def test_0_meta_locked_by_other(self):
+        def hold(conn):
+            lock = FileLock(os.path.join(self.path, "meta"))
+            lock.acquire()
+            conn.send(True)
+            time.sleep(0.5)
+            lock.release()
+        pid, conn = self.fork(hold)
+        conn.recv()
+
+        @daemonize
+        def new(conn):
+            conn.send(self.model.new({"a": 1, "b": 1}))
+
+        conn_in, conn_out = Pipe(False)
+        new(conn_out)
+        time.sleep(0.1) # The writer waits for the lock of meta in its session
+        self.assertEqual(len(self.model), 1)
+        self.assertEqual(next(self.model), 2)
+        self.assertEqual(conn_in.recv()["data"][0]["_id"], 1)
+        os.waitpid(pid, 0)
+
+    def test_1_written_by_other(self):
+        self.model.new({"a": 1, "b": 1})
+        total, next_, version = len(self.model), next(self.model), self.model.get_version()
+        def write(conn):
+            self.model.reopen()
+            self.model.new({"a": 2, "b": 2})
+            self.model.new({"a": 2, "b": 3})
+            self.model.drop({"_id": next_})
+            self.model.close()
+        pid, conn = self.fork(write)
+        os.waitpid(pid, 0)
+        self.assertEqual(len(self.model), total + 1)
+        self.assertEqual(next(self.model), next_ + 2)
+        self.assertNotEqual(self.model.get_version(), version)
+        self.assertEqual([item["b"] for item in self.model.fetch({"a": 2})["data"]], [3])
+
+
+
+class FailingShelveModel(ShelveModel):
+    write_batch_size = 8
+    write_latency = 0.02
+
+    def _new(self, data, registry, shelf):
+        if data.get("b") == "fail":
+            raise ValueError("Failing on purpose")
+        return ShelveModel._new(self, data, registry, shelf)
+
+
+class ShelveModel_Test_Batches(unittest.TestCase):
+    """Writes of several callers applied in a single session of the writer"""
+    @classmethod
+    def setUpClass(cls):
+        cls.path = r"extrafiles/shelvemodel_batches/"
+        shutil.rmtree(cls.path, True)
+        cls.model = FailingShelveModel(cls.path, 3, index_fields=["a"], headers=["a", "b"])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.close()
+        shutil.rmtree(cls.path, True)
+
+    def new_concurrently(self, datas):
+        @daemonize
+        def new(data, conn):
+            conn.send(self.model.new(data))
+
+        connections = list()
+        for data in datas:
+            conn_in, conn_out = Pipe(False)
+            connections.append(conn_in)
+            new(data, conn_out)
+        return [conn.recv() for conn in connections if conn.poll(30)]
+
+    def test_0_concurrent_new(self):
+        results = self.new_concurrently([{"a": index % 3, "b": index} for index in range(0, 40)])
+        self.assertEqual(len(results), 40)
+        ids = [result["data"][0]["_id"] for result in results]
+        self.assertEqual(len(set(ids)), 40)
+        self.assertEqual(sorted([result["data"][0]["b"] for result in results]), list(range(0, 40)))
+        self.assertEqual(len(self.model), 40)
+        self.assertEqual(self.model.get_count({}), {"count": 40})
+
+    def test_1_failing_message(self):
+        datas = [{"a": 0, "b": "fail" if index % 4 == 0 else index} for index in range(0, 16)]
+        results = self.new_concurrently(datas)
+        self.assertEqual(len(results), 16)
+        self.assertEqual(len([result for result in results if result == {"Error": 500}]), 4)
+        self.assertEqual(len(self.model), 52)
+        self.assertEqual(self.model.fetch({"a": 0})["total"], 14 + 12)
+        self.assertEqual(self.model.new({"a": 1, "b": "after"})["data"][0]["b"], "after")
+        self.assertEqual(len(self.model), 53)
+
+
+
+class ShelveModel_Test_Export(unittest.TestCase):
+    """Every item of a query, without pages"""
+    @classmethod
+    def setUpClass(cls):
+        cls.path = r"extrafiles/shelvemodel_export/"
+        shutil.rmtree(cls.path, True)
+        cls.model = ShelveModel(cls.path, 3, index_fields=["a"], headers=["a", "b"])
+        cls.model.insert([{"a": index % 2, "b": index} for index in range(0, 20)])
+        cls.model.drop({"_id": 5})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.close()
+        shutil.rmtree(cls.path, True)
+
+    def test_0_order(self):
+        exported = list(self.model.export({}, batch_size=4))
+        self.assertEqual(exported, self.model.fetch({"items_per_page": 100})["data"])
+        self.assertEqual([item["_id"] for item in exported], [_id for _id in range(1, 21) if _id != 5])
+        exported = list(self.model.export({"a": 1, "fields": "b"}, batch_size=4))
+        self.assertEqual(exported, self.model.fetch({"a": 1, "fields": "b", "items_per_page": 100})["data"])
+
+    def test_1_ids_not_listed(self):
+        filtered = self.model._filter({"items_per_page": None})
+        self.assertIsInstance(filtered["filter"], IdSet)
+        self.assertEqual(filtered["total"], 19)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import threading
+import time
+
+from zrest.tracing import Tracer
+
+
+class Tracer_Test(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer(sample_rate=1, max_traces=2)
+
+    def test_0_spans(self):
+        self.assertIsNotNone(self.tracer.start_trace("GET /model1"))
+        with self.tracer.span("model"):
+            context = self.tracer.context()
+            sent = time.perf_counter()
+            def writer():
+                self.tracer.add_span("writer.queue", sent, time.perf_counter(), context)
+                with self.tracer.attach(context), self.tracer.span("writer.fetch"):
+                    pass
+            thread = threading.Thread(target=writer)
+            thread.start()
+            thread.join()
+        trace = self.tracer.finish_trace(status=200)
+        self.assertEqual(trace["attributes"], {"status": 200})
+        spans = dict([(span["name"], span) for span in trace["spans"]])
+        self.assertEqual(set(spans), {"model", "writer.queue", "writer.fetch"})
+        self.assertIsNone(spans["model"]["parent_id"])
+        self.assertEqual(spans["writer.fetch"]["parent_id"], spans["model"]["span_id"])
+        self.assertIsNone(self.tracer.context())
+
+    def test_1_sampling(self):
+        self.tracer.configure(sample_rate=0, max_traces=2)
+        self.assertIsNone(self.tracer.start_trace("GET /model1"))
+        with self.tracer.span("model"):
+            pass
+        self.assertIsNone(self.tracer.finish_trace())
+        for index in range(0, 3):
+            self.tracer.start_trace("GET /model1/{}".format(index), force=True)
+            self.tracer.finish_trace()
+        self.assertEqual([trace["name"] for trace in self.tracer.get_traces()],
+                         ["GET /model1/2", "GET /model1/1"])
+        self.assertEqual(len(self.tracer.get_traces(limit=1)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
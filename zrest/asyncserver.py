@@ -0,0 +1,277 @@
+"""
+AsyncServer
+
+asyncio engine for App. Connections are accepted and framed on a single
+event loop, so the amount of open connections does not grow the amount of
+threads. Each request is handed to the App's Handler in a bounded executor
+once its head is framed, and its body is read from the connection as the
+Handler asks for it, so every verb (GET, POST, PUT, PATCH, DELETE, LOAD,
+NEXT, COUNT) and every Handler subclass behaves as with App.run.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import asyncio
+import traceback
+import io
+import sys
+
+__all__ = ["AsyncServer"]
+
+
+class _LoopWriter(io.RawIOBase):
+    """
+    Writable file given to the Handler as wfile. Writes are done by the event
+    loop and waited for, so a slow client slows its own worker only.
+
+    """
+    def __init__(self, loop, writer):
+        self._loop = loop
+        self._writer = writer
+
+    def writable(self):
+        return True
+
+    async def _write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def write(self, data):
+        data = bytes(data)
+        asyncio.run_coroutine_threadsafe(self._write(data), self._loop).result()
+        return len(data)
+
+
+class _LoopReader(io.RawIOBase):
+    """
+    Readable file given to the Handler as rfile. The head, already framed by
+    the connection, is read first and then the body straight from the
+    stream as the Handler asks for it, so the body is never held in memory.
+    Reads are bounded by Content-Length or by the chunked framing, so
+    nothing of the next request is taken.
+
+    """
+    def __init__(self, loop, reader, head, timeout, chunked=False, length=0):
+        self._loop = loop
+        self._reader = reader
+        self._timeout = timeout
+        self._buffer = bytes(head)
+        self._chunked = chunked
+        self._remaining = length # Bytes left of the body or of the current chunk
+        self._state = "size" if chunked else "data"
+        self.wfile = None # Flushed before waiting for the client, as for 100 Continue
+
+    @property
+    def complete(self):
+        """
+        True once the whole body has been read.
+
+        """
+        return not self._buffer and (self._state == "done" or
+                                     not self._chunked and self._remaining == 0)
+
+    def readable(self):
+        return True
+
+    async def _next(self, size):
+        if self._state == "data":
+            if self._remaining == 0:
+                return bytes()
+            data = await self._reader.read(min(size, self._remaining))
+            self._remaining -= len(data)
+            if self._chunked and self._remaining == 0:
+                self._state = "size"
+            return data
+        if self._state == "done":
+            return bytes()
+        line = await self._reader.readline()
+        if self._state == "size" and line:
+            length = int(line.split(b";")[0].strip(), 16)
+            self._state = "trailer" if length == 0 else "data"
+            self._remaining = length + 2 # Chunk and its CRLF
+        elif self._state == "trailer" and line in (b"\r\n", b"\n"):
+            self._state = "done"
+        return line
+
+    def _fetch(self, size):
+        """
+        Gets the next piece of the request, waiting for the event loop.
+
+        """
+        if not self._buffer:
+            if self.wfile is not None:
+                self.wfile.flush()
+            coroutine = asyncio.wait_for(self._next(size), self._timeout)
+            self._buffer = asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+        return self._buffer
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(65536), b""))
+        data = self._fetch(size)[:size]
+        self._buffer = self._buffer[len(data):]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        line = bytearray()
+        while size is None or size < 0 or len(line) < size:
+            left = 65536 if size is None or size < 0 else size - len(line)
+            data = self._fetch(left)
+            if not data:
+                break
+            end = data.find(b"\n", 0, left) + 1 or min(left, len(data))
+            line += data[:end]
+            self._buffer = data[end:]
+            if line.endswith(b"\n"):
+                break
+        return bytes(line)
+
+
+class AsyncServer:
+    """
+    HTTP server running on an asyncio event loop.
+
+    :method serve_forever: Runs the event loop until shutdown is called.
+    :method shutdown: Stops the server. Safe to be called from any thread.
+
+    """
+    def __init__(self, server_address, handler, *, max_workers=None,
+                                                   timeout=30,
+                                                   max_header_size=65536,
+                                                   ssl_context=None):
+        """
+        Initializes AsyncServer
+
+        :param server_address: tuple with address and port to listen to
+        :param handler: Handler class to dispatch requests to
+        :param max_workers: size of the executor running the Handler.
+                            Default of ThreadPoolExecutor if None.
+        :param timeout: seconds an idle connection is kept open
+        :param max_header_size: maximum size of request line and headers
+        :param ssl_context: ssl.SSLContext for https. None by default.
+
+        """
+        self.server_address = server_address
+        self.RequestHandlerClass = handler
+        self.timeout = timeout
+        self._max_header_size = max_header_size
+        self._ssl_context = ssl_context
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._loop = None
+        self._stop = None
+        self._connections = dict()
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._connection,
+                                            self.server_address[0],
+                                            int(self.server_address[1]),
+                                            ssl=self._ssl_context,
+                                            limit=self._max_header_size)
+        await self._stop.wait()
+        server.close()
+        for writer in self._connections.values():
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=self.timeout)
+        await self._loop.run_in_executor(None, self._executor.shutdown)
+
+    @staticmethod
+    def _content_length(head):
+        for line in head.split(b"\r\n")[1:]:
+            name, sep, value = line.partition(b":")
+            if sep and name.strip().lower() == b"content-length":
+                return int(value.strip())
+        return 0
+
+    @staticmethod
+    def _chunked(head):
+        for line in head.split(b"\r\n")[1:]:
+            name, sep, value = line.partition(b":")
+            if sep and name.strip().lower() == b"transfer-encoding":
+                return b"chunked" in value.lower()
+        return False
+
+    async def _reject(self, writer, status):
+        """
+        Answers a request which could not be framed and closes its connection.
+
+        """
+        writer.write("HTTP/1.1 {} {}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".format(
+                     status.value, status.phrase).encode("ascii"))
+        await writer.drain()
+
+    async def _connection(self, reader, writer):
+        client_address = writer.get_extra_info("peername")
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        served = 0 # Requests of the connection, as Handler counts them by instance
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._reject(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    break
+                try:
+                    rfile = _LoopReader(self._loop, reader, head, self.timeout,
+                                        chunked=self._chunked(head),
+                                        length=self._content_length(head))
+                except ValueError:
+                    await self._reject(writer, HTTPStatus.BAD_REQUEST)
+                    break
+                close = await self._loop.run_in_executor(self._executor,
+                                                         self._dispatch,
+                                                         rfile,
+                                                         client_address,
+                                                         writer,
+                                                         served)
+                served += 1
+                if close or not rfile.complete: # Next request is not where it begins
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del(self._connections[task])
+            writer.close()
+
+    def _dispatch(self, rfile, client_address, writer, served=0):
+        """
+        Runs the Handler over a single request.
+
+        :param rfile: _LoopReader of the request
+        :param served: requests served before in the connection, so the
+                       Handler closes it once it has served max_requests
+        :returns: True if the connection has to be closed
+
+        """
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = None
+        handler.server = self
+        handler.client_address = client_address
+        handler.rfile = rfile
+        handler.wfile = io.BufferedWriter(_LoopWriter(self._loop, writer), 65536)
+        rfile.wfile = handler.wfile
+        handler.close_connection = True
+        handler._requests = served
+        try:
+            handler.handle_one_request()
+            handler.wfile.flush()
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return True
+        return handler.close_connection
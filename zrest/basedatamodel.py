@@ -1,6 +1,7 @@
 import json
 from .exceptions import *
 from .statuscodes import *
+from .serializers import get_serializer
 
 
 class ModelBaseInterface:
@@ -101,7 +102,20 @@ class RestfulBaseInterface(ModelBaseInterface):
     :method delete:
     :method patch:
 
+    :attr cacheable: whether responses of get may be cached by the app
+                     until data is written. Only for models whose
+                     get_version changes with any write, as writes not
+                     done through the app are not seen otherwise.
+    :attr native: whether methods may be called with dictionaries instead
+                  of json and with native=True to return objects. Models
+                  overriding them to take json only have to leave it False.
+    :attr serializer: serializer used to parse and return json.
+
     """
+    cacheable = False
+    native = False
+    serializer = get_serializer()
+
     def _filter(self, filter):
         """
         Filter method to get data
@@ -114,112 +128,143 @@ class RestfulBaseInterface(ModelBaseInterface):
         """
         Inner method to parse given a type of information
 
-        :param data: String data to be parsed
+        :param data: String data to be parsed. Any other object is taken
+                     as already parsed.
         :param _type: Type of data. "application/json" by default
         :return: dictionary with data parsed
         :raises: HTTPResponseError(HTTP415) if type not supported
 
         """
-        return json.loads(data)
+        if not isinstance(data, (str, bytes, bytearray, memoryview)):
+            return data
+        return self.serializer.decode(data)
 
-    def _return(self, data):
+    def _return(self, data, native=False):
         """
         Inner method to return data parsed as json
 
         :param data: data to return
+        :param native: if True, data is returned as is, None if empty
         :return: data in specified type
 
         """
         if not data:
-            return str()
+            return None if native is True else str()
+        elif native is True:
+            return data
         else:
-            return json.dumps(data)
+            return self.serializer.encode(data).decode("utf-8")
 
-    def get(self, *, filter, **kwargs):
+    def get(self, *, filter, native=False, **kwargs):
         """
         For GET methods
         :param filter: dictionary
+        :param native: return objects instead of json. False by default.
         :return: data
 
         """
-        data = self._return(self.fetch(self._parse(filter), **kwargs))
+        data = self._return(self.fetch(self._parse(filter), **kwargs), native)
         return data
 
-    def post(self, *, data, **kwargs):
+    def post(self, *, data, native=False, **kwargs):
         """
         For POST Methods
         :param data: data to insert in model
+        :param native: return objects instead of json. False by default.
         :return: Data created
 
         """
         data = self.new(self._parse(data), **kwargs)
-        data = self._return(data)
+        data = self._return(data, native)
         return data
 
-    def put(self, *, filter, data, **kwargs):
+    def put(self, *, filter, data, native=False, **kwargs):
         """
         For PUT methods
         :param filter:  Filter dictionary to data
         :param data: data to update
+        :param native: return objects instead of json. False by default.
         :return: Data updated
 
         """
         data = self.replace(self._parse(filter), self._parse(data), **kwargs)
-        return self._return(data)
+        return self._return(data, native)
 
-    def delete(self, *, filter, **kwargs):
+    def delete(self, *, filter, native=False, **kwargs):
         """
         For DELETE methods
         :param filter: Filter dictionary to delete
+        :param native: return objects instead of json. False by default.
         :return: Data removed, usually nothing.
 
         """
         data = self.drop(self._parse(filter), **kwargs)
-        return self._return(data)
+        return self._return(data, native)
 
-    def patch(self, *, filter, data, **kwargs):
+    def patch(self, *, filter, data, native=False, **kwargs):
         """
         For PATCH methods
         :param filter: filter dictionary to update
         :param data: data to update to filter
+        :param native: return objects instead of json. False by default.
         :return: Data patched
 
         """
         data = self.edit(self._parse(filter), self._parse(data), **kwargs)
-        return self._return(data)
+        return self._return(data, native)
 
-    def load(self, *, data, **kwargs):
+    def load(self, *, data, native=False, **kwargs):
         """
         For LOAD methods
         :param data: data to load
+        :param native: return objects instead of json. False by default.
         :return: Data patched
 
         """
         data = self.insert(self._parse(data), **kwargs)
-        return self._return(data)
+        return self._return(data, native)
 
-    def next(self, *, filter, **kwargs):
+    def next(self, *, filter, native=False, **kwargs):
         """
 
         For NEXT methods
         :param filter: filter to get
         :param next: actual item getter
+        :param native: return objects instead of json. False by default.
         :return: Data getted
 
         """
         data = self.get_next(self._parse(filter), **kwargs)
-        return self._return(data)
+        return self._return(data, native)
 
-    def count(self, *, filter, **kwargs):
+    def count(self, *, filter, native=False, **kwargs):
         """
 
         For COUNT methods
         :param filter: filter to get the count
+        :param native: return objects instead of json. False by default.
         :return: Data getted
 
         """
         data = self.get_count(self._parse(filter), **kwargs)
-        return self._return(data)
+        return self._return(data, native)
+
+    def get_version(self):
+        """
+        Gives the version of the data of the model, which has to change each
+        time its data is written. Used to build ETags.
+
+        :return: str with the version or None if model does not track it
+
+        """
+        return None
 
     def close(self):
         pass
+
+    def reopen(self):
+        """
+        Reopens resources of the model in a forked process.
+
+        """
+        pass
@@ -0,0 +1,137 @@
+"""
+ResponseCache
+
+Size bounded LRU of responses given by App.action. Each entry is tagged with
+the names of the models its data comes from, so a write through any of them
+drops it, and keeps the version of the data it was built with, so it is not
+served once the model has changed by other means.
+"""
+from collections import OrderedDict
+import threading
+
+__all__ = ["ResponseCache"]
+
+
+class ResponseCache:
+    """
+    LRU of responses.
+
+    :method get: Gives a cached response.
+    :method put: Caches a response.
+    :method invalidate: Drops responses tagged with any given model name.
+    :method clear: Drops everything.
+    :property generation: Counter of invalidations.
+    :property stats: Dictionary with counters.
+
+    """
+    def __init__(self, max_entries=1024, max_bytes=64*1024*1024):
+        """
+        Initializes ResponseCache
+
+        :param max_entries: maximum amount of responses kept
+        :param max_bytes: maximum size of responses kept, measured as their
+                          size once encoded
+
+        """
+        self._entries = OrderedDict()  # key: (response, tags, version, size)
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0,
+                          "misses": 0,
+                          "evictions": 0,
+                          "invalidations": 0}
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"entries": len(self._entries),
+                          "bytes": self._bytes,
+                          "max_entries": self._max_entries,
+                          "max_bytes": self._max_bytes})
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / requests if requests else 0.0
+        return stats
+
+    def _drop(self, key):
+        response, tags, version, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key, version=None):
+        """
+        Gives a cached response.
+
+        :param key: normalized uri
+        :param version: current version of the data. Entries built with other
+                        version are dropped.
+        :returns: response dictionary or None if not cached
+
+        """
+        with self._lock:
+            if key in self._entries and self._entries[key][2] == version:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                response = self._entries[key][0]
+                return {"response": response["response"],
+                        "headers": dict(response["headers"]),
+                        "payload": response["payload"]}
+            elif key in self._entries:
+                self._drop(key)
+            self._counters["misses"] += 1
+
+    def put(self, key, response, tags, version=None, size=0, generation=None):
+        """
+        Caches a response.
+
+        :param key: normalized uri
+        :param response: dictionary given by App.action
+        :param tags: names of the models the response depends on
+        :param version: version of the data the response was built with
+        :param size: size of the response once encoded
+        :param generation: generation read before building the response. If
+                           there has been any invalidation since, the response
+                           may be stale and it is not cached.
+
+        """
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = ({"response": response["response"],
+                                   "headers": dict(response["headers"]),
+                                   "payload": response["payload"]},
+                                  frozenset(tags), version, size)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def invalidate(self, tags):
+        """
+        Drops every response tagged with any of given model names.
+
+        :param tags: iterable with names of models
+
+        """
+        tags = set(tags)
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if self._entries[key][1] & tags]:
+                self._drop(key)
+                self._counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,132 @@
+"""
+IdSet
+
+Set of the _id of the registries of a ShelveModel. Ids are given by a
+counter and seldom dropped, so they are kept as sorted runs of consecutive
+ids, which take as much as the gaps between them and not as the amount of
+ids. Appending the next id grows the last run, and dropping one splits the
+run it belongs to.
+"""
+from bisect import bisect_right
+
+__all__ = ["IdSet"]
+
+
+class IdSet:
+    """
+    Sorted set of ints kept as runs of consecutive ids.
+
+    :method add: Adds an id.
+    :method update: Adds every given id.
+    :method discard: Drops an id, if it is in.
+    :method slice: Gives the ids between two positions.
+    :property runs: List of tuples with the start and end of each run.
+
+    """
+    def __init__(self, ids=None, runs=None):
+        """
+        Initializes IdSet
+
+        :param ids: iterable of ids, as int or str
+        :param runs: list of tuples with start and end, not included, of
+                     each run, as given by IdSet.runs
+
+        """
+        self._starts = list()
+        self._ends = list()
+        self._len = 0
+        if runs is not None:
+            for start, end in runs:
+                self._starts.append(start)
+                self._ends.append(end)
+                self._len += end - start
+        if ids is not None:
+            self.update(ids)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, id):
+        index = bisect_right(self._starts, id) - 1
+        return index >= 0 and id < self._ends[index]
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end)
+
+    def __eq__(self, other):
+        if isinstance(other, IdSet):
+            return self.runs == other.runs
+        return NotImplemented
+
+    def __repr__(self):
+        return "IdSet(runs={})".format(self.runs)
+
+    @property
+    def runs(self):
+        return list(zip(self._starts, self._ends))
+
+    def add(self, id):
+        id = int(id)
+        index = bisect_right(self._starts, id) - 1
+        if index >= 0 and id < self._ends[index]:
+            return
+        joins_next = index + 1 < len(self._starts) and self._starts[index + 1] == id + 1
+        if index >= 0 and self._ends[index] == id:
+            if joins_next:
+                self._ends[index] = self._ends[index + 1]
+                del(self._starts[index + 1])
+                del(self._ends[index + 1])
+            else:
+                self._ends[index] = id + 1
+        elif joins_next:
+            self._starts[index + 1] = id
+        else:
+            self._starts.insert(index + 1, id)
+            self._ends.insert(index + 1, id + 1)
+        self._len += 1
+
+    def update(self, ids):
+        for id in sorted([int(id) for id in ids]):
+            self.add(id)
+
+    def discard(self, id):
+        id = int(id)
+        index = bisect_right(self._starts, id) - 1
+        if index < 0 or id >= self._ends[index]:
+            return
+        start, end = self._starts[index], self._ends[index]
+        if start == id and end == id + 1:
+            del(self._starts[index])
+            del(self._ends[index])
+        elif start == id:
+            self._starts[index] = id + 1
+        elif end == id + 1:
+            self._ends[index] = id
+        else:
+            self._ends[index] = id
+            self._starts.insert(index + 1, id + 1)
+            self._ends.insert(index + 1, end)
+        self._len -= 1
+
+    def slice(self, start, stop):
+        """
+        Gives the ids from position start to stop, not included, as a page
+        of the sorted ids, without going through the ones before it.
+
+        :param start: position of the first id
+        :param stop: position after the last id
+        :returns: list of ints
+
+        """
+        final = list()
+        position = 0
+        for first, end in zip(self._starts, self._ends):
+            if position >= stop:
+                break
+            length = end - first
+            if position + length > start:
+                final.extend(range(first + max(0, start - position),
+                                   first + min(length, stop - position)))
+            position += length
+        return final
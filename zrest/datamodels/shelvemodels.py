@@ -1,5 +1,6 @@
 # Python 3.3 or higher
 import shelve
+import dbm
 import os
 import datetime
 import time
@@ -8,39 +9,83 @@ import glob
 import sys
 import random
 import shutil
+import threading
+import itertools
+import functools
+import traceback
 
 #if sys.version_info.minor == 3:
 #    from contextlib import closing
 #    shelve_open = lambda file, flag="c", protocol=None, writeback=False: closing(shelve.open(file, flag))
 #else:
 #    shelve_open = shelve.open
-from multiprocessing import Pipe
+from multiprocessing import Pipe, resource_sharer
 from zashel.utils import threadize
 from zrest.basedatamodel import *
 from zrest.exceptions import *
+from zrest.tracing import tracer, traced
 from math import ceil
 from .filelock import FileLock, Timeout
+from .idset import IdSet
 from contextlib import contextmanager
 import json
 
 
+_lockes = dict()
+_rwlockes = dict() # filepath of a ShelveModel: _ReadWriteLock
+_dbm_suffixes = {"dbm.dumb": (".dat", ".dir"),
+                 "dbm.ndbm": (".pag", ".dir", ".db"),
+                 "dbm.gnu": ("", ),
+                 "dbm.sqlite3": ("", "-wal")} # Files of a shelf by backend, as given by dbm.whichdb
+
+
+def _reset_lockes():
+    """
+    Forgets the locks inherited from the parent process after a fork.
+    Descriptors are closed without unlocking them, as the lock belongs
+    to the parent.
+
+    """
+    for lock in _lockes.values():
+        fd = lock._lock_file_fd
+        lock._lock_file_fd = None
+        lock._lock_counter = 0
+        lock._thread_lock = threading.Lock()
+        if fd is not None:
+            os.close(fd)
+    _lockes.clear()
+    _rwlockes.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lockes)
+    # Pipes of the answers are sent to the writer through the resource sharer
+    # of multiprocessing, whose thread is not in the child. multiprocessing
+    # resets it only in the processes it starts.
+    os.register_at_fork(after_in_child=resource_sharer._resource_sharer._afterfork)
+
+
 @contextmanager
 def shelve_open(pathname, flag="c", protocol=None, writeback=False, timeout=5, poll_interval=None,
-                lockes=dict()): #It's an easy way to save it on memory
+                lockes=None):
+    if lockes is None:
+        lockes = _lockes #It's an easy way to save it on memory
     if os.path.exists(pathname) is False:
         shelf = shelve.open(pathname, "c")
         shelf.close()
     if pathname not in lockes:
-        lockes[pathname] = FileLock(pathname)
+        lockes[pathname] = FileLock(_lock_path(pathname))
     lock = lockes[pathname]
     kwargs = dict()
     if timeout is not None:
         kwargs["timeout"] = timeout
     if poll_interval is not None:
         kwargs["poll_interval"] = poll_interval
-    lock.acquire(**kwargs)
+    with tracer.span("shelve_open.lock", path=pathname):
+        lock.acquire(**kwargs)
     try:
-        shelf = shelve.open(pathname, flag, protocol, writeback)
+        with tracer.span("shelve_open.open", path=pathname, flag=flag):
+            shelf = shelve.open(pathname, flag, protocol, writeback)
         yield shelf
     except Timeout:
         pass #TODO review if it works
@@ -49,6 +94,143 @@ def shelve_open(pathname, flag="c", protocol=None, writeback=False, timeout=5, p
         lock.release()
 
 
+def _lock_path(pathname):
+    """
+    Gives the lock file of a shelf. It is the path of the shelf itself for
+    backends known not to save the shelf in it, as the lock file is
+    truncated each time it is acquired.
+
+    """
+    if "" in _dbm_suffixes.get(dbm.whichdb(pathname), ("", )):
+        return pathname + ".lock"
+    return pathname
+
+
+def _shelf_stat(pathname):
+    """
+    Gives the state of the files of a shelf, to know whether another process
+    has written them since. Files are the ones of the backend the shelf is
+    saved with, or every one named as the shelf if the backend is unknown.
+    The lock file is not taken in account, as it is truncated each time it is
+    acquired.
+
+    """
+    kind = dbm.whichdb(pathname)
+    if kind in _dbm_suffixes:
+        filenames = [pathname+suffix for suffix in _dbm_suffixes[kind]]
+    else:
+        filenames = [filename for filename in [pathname]+sorted(glob.glob(glob.escape(pathname)+".*"))
+                     if filename != _lock_path(pathname)]
+    final = list()
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            final.append(None)
+        else:
+            final.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return tuple(final)
+
+
+class _ReadWriteLock:
+    """
+    Lock of a ShelveModel shared by the threads of a process: held by
+    several readers or by the writer. Writes are queued before they are sent
+    to the writer, and a read waits for the writes queued before it, so
+    readers keep the writer waiting only for the reads already running when
+    its writes were queued.
+
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._queued = 0 # Writes sent to the writer
+        self._done = 0 # Writes applied by the writer
+
+    def queue_write(self):
+        with self._condition:
+            self._queued += 1
+
+    def acquire_read(self):
+        with self._condition:
+            ticket = self._queued
+            while self._writer is True or self._done < ticket:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            while self._writer is True or self._readers > 0:
+                self._condition.wait()
+            self._writer = True
+
+    def release_write(self, writes=0):
+        """
+        :param writes: queued writes applied meanwhile
+
+        """
+        with self._condition:
+            self._writer = False
+            self._done += writes
+            self._condition.notify_all()
+
+
+def _rwlock(filepath):
+    if filepath not in _rwlockes:
+        _rwlockes.setdefault(filepath, _ReadWriteLock())
+    return _rwlockes[filepath]
+
+
+def _reads(function):
+    """
+    Decorator running a method of ShelveModel as a read, in the thread of
+    the caller. As other processes may write along it, it is read again if
+    meta has been written by other process meanwhile.
+
+    """
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        while True:
+            with self._reading() as outermost:
+                try:
+                    result = function(self, *args, **kwargs)
+                except Exception:
+                    if outermost is False or self._read_is_current() is True:
+                        raise
+                else:
+                    if outermost is False or self._read_is_current() is True:
+                        return result
+    return wrapper
+
+
+def _sync_shelf(shelf):
+    shelf.sync()
+    if hasattr(shelf.dict, "_modified"): # dbm.dumb rewrites its whole index on each sync otherwise
+        shelf.dict._modified = False
+
+
+def _discard_shelf(shelf, close=True):
+    """
+    Closes a shelf without writing what it may have pending, as its files
+    may have been written by another process since.
+
+    :param close: False if it may still be read by other threads. It is
+                  closed once it is not referenced.
+
+    """
+    if hasattr(shelf.dict, "_modified"):
+        shelf.dict._modified = False
+    if close is True:
+        shelf.close()
+
+
 class ShelveModel(RestfulBaseInterface):
     """
     ShelveModel with a double interface:
@@ -58,6 +240,11 @@ class ShelveModel(RestfulBaseInterface):
     To use with zrest.
 
     """
+    cacheable = True
+    native = True
+    write_batch_size = 100 # Messages applied by the writer in a single session
+    write_latency = 0 # Seconds the writer waits for more messages. Only the ones queued if 0
+
     def __init__(self, filepath, groups=10, *, index_fields=None,
                                                headers=None,
                                                name=None,
@@ -93,6 +280,7 @@ class ShelveModel(RestfulBaseInterface):
         self._filepath = filepath
         self._alive = False
         self._opened = True
+        self._pid = os.getpid()
         self._pipe_in, self._pipe_out = Pipe(False)
         self._close = False
         self._headers = headers
@@ -106,14 +294,22 @@ class ShelveModel(RestfulBaseInterface):
         self._name = name
         self.items_per_page = items_per_page
         self._to_block = to_block
+        self._handles = dict() # path: {"shelf", "stat"}. Kept by the writer
+        self._session_owner = None
+        self._session_locks = list()
+        self._session_paths = set()
+        self._handles_lock = threading.Lock() # Handles reopened by readers
+        self._generation = 0 # Times meta has been found written by other process
+        self._local = threading.local() # shelves and meta read by the read of each thread
+        self._counters = None # total, next, version, epoch and ids. Kept by the writer
+        self._counters_changed = False
         if index_fields is None:
             self._index_fields = list()
         else:
             assert isinstance(index_fields, list)
             self._index_fields = index_fields
         try:
-            assert any([os.path.exists(file)
-                    for file in glob.glob("{}.*".format(self._meta_path))]+[False])
+            assert dbm.whichdb(self._meta_path) # Files of meta depend on the backend
         except AssertionError:
             with shelve_open(self._meta_path) as shelf:
                 shelf["filepath"] = self._meta_path
@@ -122,7 +318,9 @@ class ShelveModel(RestfulBaseInterface):
                 shelf["groups"] = groups
                 shelf["class"] = self.__class__.__name__
                 shelf["name"] = self._name
-                shelf["ids"] = list()
+                shelf["id_runs"] = list()
+                shelf["version"] = 0
+                shelf["epoch"] = uuid.uuid4().hex[:8]
             if self.light_index is False:
                 for index in self.index_fields:
                     if (self._unique_is_id is True and self._unique != index) or self._unique_is_id is False:
@@ -143,47 +341,86 @@ class ShelveModel(RestfulBaseInterface):
         self._as_child = list()
 
     def __len__(self):
-        final = None
-        while True:
-            try:
-                with shelve_open(self._meta_path, "r") as meta:
-                    final = meta["total"]
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except Exception as e:
-                print("__len__: ", e)
-                continue
-            else:
-                if final is not None:
-                    break
-        return final
+        return self._counter("total")
 
     def __next__(self): #This is not very appropiate, but...
-        final = None
-        while True:
-            try:
-                with shelve_open(self._meta_path, "r") as meta:
-                    final = meta["next"]
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except Exception as e:
-                print("__next__: ", e)
-                continue
-            else:
-                if final is not None:
-                    break
-        return final
+        return self._counter("next")
+
+    def get_version(self):
+        """
+        Gives the version of the data, bumped by every write.
+        :returns: str with the epoch of the database and its change counter
+
+        """
+        with self._reading(): # Both of the same write
+            return "{}-{}".format(self._counter("epoch"), self._counter("version"))
+
+    def _counter(self, name):
+        """
+        Gives total, next, version or epoch. The writer keeps them in memory.
+        Other threads read them in a read, so they are loaded from meta if it
+        has been written by other process, and they are never the ones of a
+        session of the writer which has not ended yet.
+
+        """
+        with self._reading(): # Nothing to wait for in the session of the writer
+            return self._counters[name]
+
+    def _read_counters(self, meta):
+        return {"total": meta["total"],
+                "next": meta["next"],
+                "version": meta.get("version", 0),
+                "epoch": meta.get("epoch", "0")}
+
+    def _load_counters(self, meta):
+        counters = self._read_counters(meta)
+        counters["ids"] = self._load_ids(meta)
+        self._counters = counters
+        self._counters_changed = False
+
+    def _save_counters(self, meta):
+        for name in ("total", "next", "version"):
+            meta[name] = self._counters[name]
+        self._save_ids(meta, self._counters["ids"])
+        self._counters_changed = False
+
+    def _count(self, total=0, next=0):
+        """
+        Changes the counters of the writer, which are saved at the end of its
+        session, and bumps the version.
+
+        """
+        self._counters["total"] += total
+        self._counters["next"] += next
+        self._counters["version"] += 1
+        self._counters_changed = True
+
+    def _load_ids(self, meta):
+        """
+        Gives the ids saved in meta. Databases with a list of ids, as saved by
+        former versions, are read as well and migrated when ids are saved.
+        :returns: IdSet
+
+        """
+        if "id_runs" in meta:
+            return IdSet(runs=meta["id_runs"])
+        return IdSet(meta.get("ids", list()))
+
+    def _save_ids(self, meta, ids):
+        meta["id_runs"] = ids.runs
+        if "ids" in meta:
+            del(meta["ids"])
 
     @property
     def name(self):
         if self._name == None:
-            with shelve_open(self._meta_path, "r") as shelf:
+            with self._open(self._meta_path, "r") as shelf:
                 self._name = shelf["name"]
         return self._name
 
     @name.setter
     def name(self, value):
-        with shelve_open(self._meta_path) as shelf:
+        with self._open(self._meta_path) as shelf:
             shelf["name"] = value
         self._name = value
 
@@ -211,7 +448,7 @@ class ShelveModel(RestfulBaseInterface):
     def headers(self):
         if self._headers is None and self._headers_checked is False:
             try:
-                with shelve_open(self._data_path(0), "r") as shelf:
+                with self._open(self._data_path(0), "r") as shelf:
                     self._headers = shelf["headers"]
             except KeyError:
                 self._headers = None
@@ -238,8 +475,186 @@ class ShelveModel(RestfulBaseInterface):
     def _data_path(self, group):
         return os.path.join(self.filepath, "data_{}".format(str(group)))
 
+    def _lock(self, path):
+        if path not in _lockes:
+            _lockes.setdefault(path, FileLock(_lock_path(path)))
+        return _lockes[path]
+
+    @contextmanager
+    def _session(self):
+        """
+        Session of the writer. The lock of meta is held along it, so writers
+        of other processes wait, and shelves are used through handles kept
+        open between sessions. Each one is locked the first time it is used in
+        the session. Counters are saved once, with the rest of the writes.
+        Written shelves are synced at its end, or closed if their backend
+        can't sync them. The lock of the model for writing has to be held, so
+        reads of other threads wait for it to end. If it fails, handles and
+        counters are dropped, so they are read again from the files, and
+        nothing else of it is written.
+
+        """
+        self._session_owner = threading.get_ident()
+        try:
+            self._shelf(self._meta_path)
+            yield
+            if self._counters_changed is True:
+                self._save_counters(self._shelf(self._meta_path))
+            for path in self._session_paths:
+                handle = self._handles[path]
+                if hasattr(handle["shelf"].dict, "sync"):
+                    _sync_shelf(handle["shelf"])
+                    handle["stat"] = _shelf_stat(path)
+                else: # Backends as ndbm write it only once closed
+                    handle["shelf"].close()
+                    del(self._handles[path])
+        except BaseException:
+            self._close_handles(discard=True)
+            self._counters = None
+            self._counters_changed = False
+            raise
+        finally:
+            self._session_owner = None
+            self._session_paths = set()
+            while self._session_locks:
+                self._session_locks.pop().release()
+
+    @contextmanager
+    def _reading(self):
+        """
+        Read in the thread of the caller, along with reads of other threads,
+        but not while the writer is in a session. Shelves are read through
+        the handles of the writer. The lock of meta is held only to check
+        them at its start, so reads of other processes go along with it, and
+        whether meta has been written since is checked by _read_is_current.
+        Reads inside a read or in the writer are part of them.
+        :yields: True if it is not part of other read or the writer
+
+        """
+        if self._session_owner == threading.get_ident() or getattr(self._local, "shelves", None) is not None:
+            yield False
+            return
+        lock = _rwlock(self.filepath)
+        with tracer.span("ShelveModel.read_lock"):
+            lock.acquire_read()
+        try:
+            self._local.shelves = dict()
+            with self._meta_locked():
+                self._local.stat = self._check_handle(self._meta_path)["stat"]
+                self._local.shelves[self._meta_path] = self._handles[self._meta_path]["shelf"]
+            yield True
+        finally:
+            self._local.shelves = None
+            lock.release_read()
+
+    @contextmanager
+    def _meta_locked(self):
+        """
+        Holds the lock of meta and the one of the handles, to check or reopen
+        them.
+
+        """
+        if os.path.exists(self._meta_path) is False:
+            shelve.open(self._meta_path, "c").close()
+        with self._lock(self._meta_path), self._handles_lock:
+            yield
+
+    def _read_is_current(self):
+        """
+        Whether meta has not been written by other process since the read of
+        this thread started.
+
+        """
+        with self._meta_locked():
+            return _shelf_stat(self._meta_path) == self._local.stat
+
+    def _read_shelf(self, path):
+        """
+        Gives the handle of the shelf in path for the read of this thread.
+        Shelves not checked since meta was last reopened are checked under
+        the lock of meta.
+
+        """
+        shelves = self._local.shelves
+        if path not in shelves:
+            with self._handles_lock:
+                handle = self._handles.get(path)
+                if handle is not None and handle["generation"] == self._generation:
+                    shelves[path] = handle["shelf"]
+            if path not in shelves:
+                with self._meta_locked():
+                    shelves[path] = self._check_handle(path)["shelf"]
+        return shelves[path]
+
+    def _shelf(self, path):
+        """
+        Gives the handle of the shelf in path for the current session.
+
+        """
+        if path not in self._session_paths:
+            if os.path.exists(path) is False: # As shelve_open, before the lock file is created
+                shelve.open(path, "c").close()
+            self._lock(path).acquire()
+            self._session_locks.append(self._lock(path))
+            with self._handles_lock:
+                self._check_handle(path)
+            self._session_paths.add(path)
+        return self._handles[path]["shelf"]
+
+    def _check_handle(self, path):
+        """
+        Gives the handle of the shelf in path, reopened if other process has
+        written it since. Each session of a writer writes meta, so meta is
+        checked each time and the rest of the shelves only once meta has been
+        written by other process. Counters are loaded when meta is (re)opened.
+        The lock of meta has to be held.
+
+        """
+        handle = self._handles.get(path)
+        if handle is not None and path != self._meta_path and handle["generation"] == self._generation:
+            return handle
+        stat = _shelf_stat(path)
+        if handle is None or handle["stat"] != stat:
+            if handle is not None:
+                _discard_shelf(handle["shelf"], close=False) # Other reads may use it yet
+            handle = {"shelf": shelve.open(path, "c"), "stat": stat}
+            self._handles[path] = handle
+            if path == self._meta_path:
+                self._generation += 1
+                self._load_counters(handle["shelf"])
+        handle["generation"] = self._generation
+        return handle
+
+    def _close_handles(self, discard=False):
+        for path in list(self._handles):
+            if discard is True:
+                _discard_shelf(self._handles[path]["shelf"])
+            else:
+                self._handles[path]["shelf"].close()
+        self._handles = dict()
+
+    @contextmanager
+    def _open(self, path, flag="c"):
+        """
+        Opens a shelf of the model. The writer and reads use the handles of the
+        writer, anything else opens it as usual.
+
+        """
+        if self._session_owner == threading.get_ident():
+            yield self._shelf(path)
+        elif getattr(self._local, "shelves", None) is not None:
+            yield self._read_shelf(path)
+        else:
+            with shelve_open(path, flag) as shelf:
+                yield shelf
+
     def _send_pipe(self, **kwargs):
+        context = tracer.context()
+        if context is not None: # The writer continues the trace
+            kwargs["trace"] = context
+            kwargs["sent"] = time.perf_counter()
         self._pipe_out.send(kwargs)
+        _rwlock(self.filepath).queue_write()
 
     def get_unique_hash(self, data):
         final = str()
@@ -257,19 +672,21 @@ class ShelveModel(RestfulBaseInterface):
     def fetch(self, filter, **kwargs):
         """
         Gives the result of a query.
+        It is read in the thread of the caller, along with other reads, but
+        not while the writer is applying writes.
         :param filter: dictionary with wanted coincidences
         :returns: dictionary with result of the query
 
         """
-        conn_in, conn_out = Pipe(False)
-        self._send_pipe(action="fetch", filter=filter, data={}, pipe=conn_out)
-        return conn_in.recv()
+        return self.direct_fetch(filter)
 
+    @traced("ShelveModel._fetch")
+    @_reads
     def _fetch(self, registries, shelf):
         if isinstance(registries, int):
             registries = {registries}
         final = list()
-        with shelve_open(shelf, "r") as file:
+        with self._open(shelf, "r") as file:
             for item in registries:
                 try:
                     data = file[str(item)]
@@ -305,7 +722,7 @@ class ShelveModel(RestfulBaseInterface):
         else:
             field = None
             data_field = None
-            with shelve_open(self._index_path(self.unique)) as shelf:
+            with self._open(self._index_path(self.unique)) as shelf:
                 if data_field in shelf and shelf[self.get_unique_hash(data)] != set():
                     return True
                 else:
@@ -326,7 +743,7 @@ class ShelveModel(RestfulBaseInterface):
             for field in data:
                 if (any([os.path.exists(file)
                         for file in glob.glob("{}.*".format(self._index_path(field)))]+[False])):
-                    with shelve_open(self._index_path(field)) as shelf:
+                    with self._open(self._index_path(field)) as shelf:
                         index = str(data[field])
                         last = shelf
                         if not index in shelf:
@@ -350,7 +767,7 @@ class ShelveModel(RestfulBaseInterface):
                         else:
                             shelf[str(index)] = {registry}
             if len(self._unique) > 1:
-                with shelve_open(self._index_path("_unique")) as shelf:
+                with self._open(self._index_path("_unique")) as shelf:
                     shelf[self.get_unique_hash(data)] = {registry}
                     
     def _del_index(self, data, registry):
@@ -370,12 +787,12 @@ class ShelveModel(RestfulBaseInterface):
             for field in data:
                 if (any([os.path.exists(file)
                         for file in glob.glob("{}.*".format(self._index_path(field)))]+[False])):
-                    with shelve_open(self._index_path(field)) as shelf:
+                    with self._open(self._index_path(field)) as shelf:
                         index = str(data[field])
                         if index in shelf:
                             shelf[index] -= {registry}
             if len(self._unique) > 1:
-                with shelve_open(self._index_path(field)) as shelf:
+                with self._open(self._index_path(field)) as shelf:
                     index = str(data[field])
                     if index in shelf:
                         del(shelf[index])
@@ -406,9 +823,10 @@ class ShelveModel(RestfulBaseInterface):
         else:
             return {"Error": 501}
 
+    @traced("ShelveModel._insert")
     def _insert(self, data, filename_reg):
         for filename in filename_reg:
-            with shelve_open(filename) as shelf:
+            with self._open(filename) as shelf:
                 for index in filename_reg[filename]:
                     new_data = data[str(index)]
                     if self.headers is not None:
@@ -418,9 +836,12 @@ class ShelveModel(RestfulBaseInterface):
                                 new_data.append(data[str(index)][header])
                             except KeyError:
                                 new_data.append("")
+                    shelf[str(index)] = new_data
         for index_name in self.index_fields:
              index_dict = dict()
              for index in data:
+                 if index_name not in data[index]:
+                     continue
                  if str(data[index][index_name]) not in index_dict:
                      index_dict[str(data[index][index_name])] = set()
                  index_dict[str(data[index][index_name])].add(int(index))
@@ -429,21 +850,18 @@ class ShelveModel(RestfulBaseInterface):
                      for item in index_dict[index]:
                          item = str(item)
                          try:
-                            os.makedirs(os.path.join(self._index_path(index_name), index, item))
+                            os.makedirs(os.path.join(self._index_path(index_name), index, item), exist_ok=True)
                          except PermissionError:
                              pass
              else:
-                 with shelve_open(self._index_path(index_name)) as shelf:
+                 with self._open(self._index_path(index_name)) as shelf:
                      for index in index_dict:
                          if index not in shelf:
                              shelf[index] = index_dict[index]
                          else:
                              shelf[index] |= index_dict[index]
-        with shelve_open(self._meta_path) as shelf:
-             total, next_ = len(self), next(self)
-             shelf["total"] = total + len(data)
-             shelf["next"] = next_ + len(data)
-             shelf["ids"] = set([int(key) for key in list(data.keys())])
+        self._counters["ids"].update(data)
+        self._count(total=len(data), next=len(data))
 
     def new(self, data, **kwargs): #TODO: Errors setting new data
         """
@@ -453,19 +871,32 @@ class ShelveModel(RestfulBaseInterface):
         :returns: New Data
 
         """
-        if self._check_child(data) != 0:
-            return None
+        message, result = self._prepare_new(data)
+        if message is None:
+            return result
         conn_in, conn_out = Pipe(False)
-        test = None
-        if self._is_unique(data) is True:
-            self._send_pipe(action="replace", data=data, filter={self.unique: self.get_unique_hash(data)}, pipe=conn_out)
-        else:
-            self._send_pipe(action="new", data=data, pipe=conn_out)
+        self._send_pipe(pipe=conn_out, **message)
         recv = conn_in.recv()
         return recv
 
+    def _prepare_new(self, data, **kwargs):
+        """
+        Checks given data before it is set as new.
+        :returns: tuple with the message for the writer, None if it has not to
+                  be written, and the result to give in that case
+
+        """
+        if self._check_child(data) != 0:
+            return None, None
+        if self._is_unique(data) is True:
+            return {"action": "replace", "data": data,
+                    "filter": {self.unique: self.get_unique_hash(data)}}, None
+        else:
+            return {"action": "new", "data": data}, None
+
+    @traced("ShelveModel._new")
     def _new(self, data, registry, shelf):
-        with shelve_open(shelf) as file:
+        with self._open(shelf) as file:
             if self.headers is not None:
                 new_data = list()
                 for header in self.headers:
@@ -475,13 +906,8 @@ class ShelveModel(RestfulBaseInterface):
                         new_data.append("")
                 data = new_data
             file[str(registry)] = data
-        with shelve_open(self._meta_path) as file:
-            total, next_ = len(self), next(self) #Bug!
-            file["total"] = total + 1
-            file["next"] = next_ + 1
-            ids = list(file["ids"])
-            ids.append(str(registry))
-            file["ids"] = ids
+        self._counters["ids"].add(registry)
+        self._count(total=1, next=1)
         self._set_index(data, registry)
 
     def replace(self, filter, data, **kwargs):
@@ -493,21 +919,35 @@ class ShelveModel(RestfulBaseInterface):
         :returns: Data replaced
 
         """
-        if self._check_child(data) != 0:
-            return None
+        message, result = self._prepare_replace(filter, data)
+        if message is None:
+            return result
         conn_in, conn_out = Pipe(False)
+        self._send_pipe(pipe=conn_out, **message)
+        return conn_in.recv()
+
+    def _prepare_replace(self, filter, data, **kwargs):
+        """
+        Checks given data before replacing filtered data with it.
+        :returns: tuple with the message for the writer, None if it has not to
+                  be written, and the result to give in that case
+
+        """
+        if self._check_child(data) != 0:
+            return None, None
         test = None
         if ((self.unique in data and self.unique not in filter) or
             (self.unique in data and self.unique in filter and data[self.unique]!=filter[self.unique])):
             test = self.fetch({self.unique: data[self.unique]})
         if not test:
-            self._send_pipe(action="replace", filter=filter, data=data, pipe=conn_out)
+            return {"action": "replace", "filter": filter, "data": data}, None
         else:
-            return {"Error": "400"}
-        return conn_in.recv()
+            return None, {"Error": "400"}
 
+    @traced("ShelveModel._replace")
     def _replace(self, data, registries, shelf):
-        with shelve_open(shelf) as file:
+        replaced = False
+        with self._open(shelf) as file:
             for reg in registries:
                 try:
                     old_data = self._fetch({reg}, shelf)[0]
@@ -524,24 +964,39 @@ class ShelveModel(RestfulBaseInterface):
                             new_data = [new_data[item] for item in self.headers]
                         file[str(reg)] = new_data
                         self._set_index(new_data, reg)
+                        replaced = True
+        if replaced is True:
+            self._count()
 
     def edit(self, filter, data, **kwargs):
         """
         replace alias
 
         """
-        if self._check_child(data) == 2:
-            return None
+        message, result = self._prepare_edit(filter, data)
+        if message is None:
+            return result
         conn_in, conn_out = Pipe(False)
+        self._send_pipe(pipe=conn_out, **message)
+        return conn_in.recv()
+
+    def _prepare_edit(self, filter, data, **kwargs):
+        """
+        Checks given data before editing filtered data with it.
+        :returns: tuple with the message for the writer, None if it has not to
+                  be written, and the result to give in that case
+
+        """
+        if self._check_child(data) == 2:
+            return None, None
         test = None
         if ((self.unique in data and self.unique not in filter) or
                 (self.unique in data and self.unique in filter and data[self.unique] != filter[self.unique])):
             test = self.fetch({self.unique: data[self.unique]}) #TODO Better
         if not test:
-            self._send_pipe(action="edit", filter=filter, data=data, pipe=conn_out)
+            return {"action": "edit", "filter": filter, "data": data}, None
         else:
-            return {"Error": "400"}
-        return conn_in.recv()
+            return None, {"Error": "400"}
 
     def _edit(self, data, registries, shelf):
         self._replace(data, registries, shelf)
@@ -553,10 +1008,44 @@ class ShelveModel(RestfulBaseInterface):
         :param filter: dictionary with given filter
         :returns: Data
         """
+        message, result = self._prepare_drop(filter)
         conn_in, conn_out = Pipe(False)
-        self._send_pipe(action="drop", filter=filter, data={}, pipe=conn_out)
+        self._send_pipe(pipe=conn_out, **message)
         return conn_in.recv()
 
+    def _prepare_drop(self, filter, **kwargs):
+        return {"action": "drop", "filter": filter, "data": {}}, None
+
+    def bulk(self, operations, **kwargs):
+        """
+        Applies several writes in a single pass of the writer, so no other
+        write is done in the middle. Data is checked, as new, replace, edit
+        and drop do, before any of them is written.
+        Blocks untill finnish
+        :param operations: list of tuples with action ("new", "replace",
+                           "edit" or "drop"), filter and data
+        :returns: list with the result of each operation, as given by the
+                  method of its action
+
+        """
+        results = [None for operation in operations]
+        messages = list()
+        positions = list()
+        for index, (action, filter, data) in enumerate(operations):
+            message, result = self.__getattribute__("_prepare_{}".format(action))(filter=filter, data=data)
+            if message is None:
+                results[index] = result
+            else:
+                messages.append(message)
+                positions.append(index)
+        if messages:
+            conn_in, conn_out = Pipe(False)
+            self._send_pipe(action="bulk", data=messages, pipe=conn_out)
+            for index, result in zip(positions, conn_in.recv()):
+                results[index] = result
+        return results
+
+    @traced("ShelveModel._drop")
     def _drop(self, data, registries, shelf):
         for reg in registries:
             try:
@@ -571,27 +1060,28 @@ class ShelveModel(RestfulBaseInterface):
                             continue
                 if old_data != list():
                     self._del_index(old_data, reg)
-                    with shelve_open(shelf) as file:
+                    with self._open(shelf) as file:
                         del(file[str(reg)])
-                    with shelve_open(self._meta_path) as file:
-                        file["total"] -= 1
-                        ids = list(file["ids"])
-                        del(ids[ids.index(str(reg))])
-                        file["ids"] = ids
+                    self._counters["ids"].discard(reg)
+                    self._count(total=-1)
 
+    @traced("ShelveModel._filter")
+    @_reads
     def _filter(self, filter):
         while True:
             try:
-                with shelve_open(self._meta_path) as shelf:
-                    ids = list(shelf["ids"])
-                final_set = set([int(id) for id in ids])
+                if self._session_owner == threading.get_ident():
+                    ids = self._counters["ids"]
+                else:
+                    with self._open(self._meta_path) as shelf:
+                        ids = self._load_ids(shelf)
             except (KeyError, PermissionError) as e:
                 print("_filter: ", e)
                 time.sleep(random.randint(0, 2)+random.randint(0, 1000)/1000)
                 continue
             else:
                 break
-        #final_set = set(range(0, next(self)))
+        final_set = None # Every id, which are not gone through unless a field filters them
         order = str()
         fields = list()
         page = 1
@@ -616,7 +1106,7 @@ class ShelveModel(RestfulBaseInterface):
                 if field == "_id" and filter[field] != "":
                     subfilter = {int(filter["_id"])}
                 elif field == "_id" and filter[field] == "":
-                    subfilter = final_set
+                    continue
                 else:
                     if self.light_index is True:
                         if os.path.exists(os.path.join(self._index_path(field), str(filter[field]))) is True:
@@ -625,7 +1115,7 @@ class ShelveModel(RestfulBaseInterface):
                     else:
                         if any([os.path.exists(file)
                                 for file in glob.glob("{}.*".format(self._index_path(field)))]+[False]):
-                            with shelve_open(self._index_path(field), "r") as index:
+                            with self._open(self._index_path(field), "r") as index:
                                 if self.unique != field or self._split_unique == 0:
                                     if str(filter[field]) in index:
                                         subfilter = index[str(filter[field])]
@@ -639,9 +1129,14 @@ class ShelveModel(RestfulBaseInterface):
                                         inter = str(index)[offset+x*self._split_unique:offset+(x+1)*self._split_unique]
                                         last = last[inter]
                                     subfilter = {last}
-                final_set &= subfilter
-        final_set = list(final_set)
-        final_set.sort()
+                if final_set is None:
+                    final_set = set([id for id in subfilter if id in ids])
+                else:
+                    final_set &= subfilter
+        if final_set is None:
+            final_set = ids
+        else:
+            final_set = sorted(final_set)
         if len(order) > 0:
             for _id in final_set:
                 if self.light_index is True:
@@ -655,7 +1150,7 @@ class ShelveModel(RestfulBaseInterface):
                         sfield = field
                     if any([os.path.exists(file)
                             for file in glob.glob("{}.*".format(self._index_path(sfield)))] + [False]):
-                        with shelve_open(self._index_path(sfield), "r") as index:
+                        with self._open(self._index_path(sfield), "r") as index:
                             sub_order[sfield] = index.copy()
                         keys = list(sub_order.keys())
                         if field.startswith("-"):
@@ -668,10 +1163,22 @@ class ShelveModel(RestfulBaseInterface):
                                     final_order.append(key)
         else:
             final_order = final_set
-        return {"filter": final_order[int(items_per_page)*(int(page)-1):int(items_per_page)*int(page)],
+        if items_per_page is None: # Every one, without pages. Ids are not listed if not filtered
+            if isinstance(final_order, IdSet):
+                page_filter = IdSet(runs=final_order.runs)
+            else:
+                page_filter = final_order
+        else:
+            items_per_page = int(items_per_page)
+            start, stop = items_per_page*(int(page)-1), items_per_page*int(page)
+            if isinstance(final_order, IdSet):
+                page_filter = final_order.slice(start, stop)
+            else:
+                page_filter = final_order[start:stop]
+        return {"filter": page_filter,
                 "total": len(final_order),
                 "page": int(page),
-                "items_per_page": int(items_per_page),
+                "items_per_page": items_per_page,
                 "fields": fields}
 
     def _get_datafile(self, filter):
@@ -688,6 +1195,8 @@ class ShelveModel(RestfulBaseInterface):
         filter = self._filter(filter)
         return({"count": filter["total"]})
 
+    @traced("ShelveModel.direct_fetch")
+    @_reads
     def direct_fetch(self, filter, filtered=None, **kwargs):
         print("Filter Direct_Fetch: ", filter)
         final = list()
@@ -720,102 +1229,211 @@ class ShelveModel(RestfulBaseInterface):
                      "page": filtered["page"],
                      "items_per_page": filtered["items_per_page"]})
 
+    def export(self, filter, batch_size=1000, **kwargs):
+        """
+        Iterates every item matching filter, without pages, in the order
+        fetch gives them. The filter is resolved once, without listing the
+        ids if no field filters them, and items are read in batches of
+        batch_size registries, each one from the data groups it is in, so
+        memory does not depend on the amount of items and shelves are not
+        kept locked while items are consumed.
+
+        :param filter: dictionary with wanted coincidences
+        :param batch_size: registries read each time
+        :returns: generator of dictionaries
+
+        """
+        filter = dict(filter)
+        filter["page"] = 1
+        filter["items_per_page"] = None
+        filtered = self._filter(filter)
+        registries = iter(filtered["filter"])
+        while True:
+            batch = list(itertools.islice(registries, batch_size))
+            if not batch:
+                break
+            items = dict()
+            for filename, group in self._get_datafile(batch).items():
+                for item in self._fetch(group, filename):
+                    items[item["_id"]] = item
+            for _id in batch:
+                if _id in items:
+                    item = items[_id]
+                    if filtered["fields"]:
+                        item = dict([(field, item[field]) for field in item
+                                     if field == "_id" or field in filtered["fields"]])
+                    yield item
+
     @threadize
     def _writer(self):
         """
         It may receive by self._pipe_out a dictionary with:
-        action: new, replace, drop or edit
+        action: new, replace, drop, edit, insert, fetch or bulk
         filter: if not new, a set of registries
-        data: dictionary with the new data
+        data: dictionary with the new data. A list of dictionaries as these
+              if bulk, which are applied in order.
+        Messages queued are applied together, in order, in a single session,
+        so shelves are synced once for all of them before answering each one.
         """
-        new = int()
         while True:
-            try:
-                data = self._pipe_in.recv()
-            except EOFError:
+            messages = self._receive()
+            if not messages:
+                _rwlock(self.filepath).acquire_write()
+                try:
+                    self._close_handles()
+                finally:
+                    _rwlock(self.filepath).release_write()
                 self._close = True
                 break
+            lock = _rwlock(self.filepath)
+            lock.acquire_write()
+            try:
+                sends = list()
+                try:
+                    with self._session():
+                        for data in messages:
+                            context = data.get("trace")
+                            if context is not None:
+                                tracer.add_span("writer.queue", data["sent"], time.perf_counter(), context)
+                            with tracer.attach(context), tracer.span("writer.{}".format(data["action"]),
+                                                                     batch=len(messages)):
+                                if data["action"] == "bulk":
+                                    sends.append([self._attempt(message) for message in data["data"]])
+                                else:
+                                    sends.append(self._attempt(data))
+                except Exception: # The session itself failed, so none of them is sure to be written
+                    traceback.print_exc()
+                    sends = [[{"Error": 500}]*len(data["data"]) if data["action"] == "bulk" else {"Error": 500}
+                             for data in messages]
+                self._alive = False
+                for data, send in zip(messages, sends): # Before reads go on, which would keep callers waiting
+                    data["pipe"].send(send)
+            finally:
+                lock.release_write(len(messages))
+
+    def _receive(self):
+        """
+        Waits for a message for the writer and takes the ones sent meanwhile,
+        up to write_batch_size, waiting write_latency seconds at most for them.
+        :returns: list of messages. Empty if the pipe is closed.
+
+        """
+        try:
+            messages = [self._pipe_in.recv()]
+        except EOFError:
+            return list()
+        deadline = time.perf_counter() + self.write_latency
+        try:
+            while (len(messages) < self.write_batch_size and
+                    self._pipe_in.poll(max(0, deadline - time.perf_counter()))):
+                messages.append(self._pipe_in.recv())
+        except EOFError:
+            pass # Given back with the next call
+        return messages
+
+    def _attempt(self, data):
+        """
+        Applies a single message of the writer, answering it with an error if
+        it fails, so the rest of the session goes on. Counters are set back,
+        but for next, as the ids given out may be in the indexes already.
+        :returns: what is sent back to the caller
+
+        """
+        counters = dict(self._counters, ids=IdSet(runs=self._counters["ids"].runs))
+        try:
+            return self._apply(data)
+        except Exception:
+            traceback.print_exc()
+            counters["next"] = self._counters["next"]
+            self._counters = counters
+            self._counters_changed = True
+            return {"Error": 500}
+
+    def _apply(self, data):
+        """
+        Applies a single message of the writer.
+        :param data: dictionary with action, filter and data
+        :returns: what is sent back to the caller
+
+        """
+        send = 0
+        if "filter" in data and data["action"] not in ("new", "fetch"):
+            filter = data["filter"]
+            filtered = self._filter(filter)
+            filter = filtered["filter"]
+            filename_reg = self._get_datafile(filter)
+        else:
+            if self._unique_is_id and self.unique in data["data"]:
+                filename_reg = data["data"][self.unique]
+                filename_reg = {self._data_path(filename_reg%self.groups): filename_reg}
+                del(data[self.unique])
+            elif isinstance(data["data"], list) and data["action"] == "insert":
+                total = next(self)
+                total_reg = len(data["data"])
+                filename_reg = dict()
+                for index, x in enumerate(range(total, total+total_reg)):
+                    data_path = self._data_path(x % self.groups)
+                    if data_path not in filename_reg:
+                        filename_reg[data_path] = set()
+                    filename_reg[data_path].add(x)
+                    if not "dict_data" in data:
+                        data["dict_data"] = dict()
+                    data["dict_data"][str(x)] = data["data"][index]
+                data["data"] = dict(data["dict_data"])
+                del(data["dict_data"])
             else:
-                send = 0
-                if "filter" in data and data["action"] not in ("new", "fetch"):
-                    filter = data["filter"]
-                    filtered = self._filter(filter)
-                    filter = filtered["filter"]
-                    filename_reg = self._get_datafile(filter)
-                else:
-                    if self._unique_is_id and self.unique in data["data"]:
-                        filename_reg = data["data"][self.unique]
-                        filename_reg = {self._data_path(filename_reg%self.groups): filename_reg}
-                        del(data[self.unique])
-                    elif isinstance(data["data"], list) and data["action"] == "insert":
-                        total = next(self)
-                        total_reg = len(data["data"])
-                        filename_reg = dict()
-                        for index, x in enumerate(range(total, total+total_reg)):
-                            data_path = self._data_path(x % self.groups)
-                            if data_path not in filename_reg:
-                                filename_reg[data_path] = set()
-                            filename_reg[data_path].add(x)
-                            if not "dict_data" in data:
-                                data["dict_data"] = dict()
-                            data["dict_data"][str(x)] = data["data"][index]
-                        data["data"] = dict(data["dict_data"])
-                        del(data["dict_data"])
+                total = next(self)
+                filename_reg = {self._data_path(total % self.groups): total}
+        for filename in filename_reg:
+            if data["action"] != "insert":
+                while True:
+                    try:
+                        if data["action"] != "fetch":
+                            self.__getattribute__("_{}".format(data["action"]))(data["data"],
+                                                                                filename_reg[filename],
+                                                                                filename)
+                    except (KeyboardInterrupt, SystemExit):
+                        raise
+                    except Exception as e:
+                        print(e)
+                        raise
+                        time.sleep(0.1)
+                        continue
                     else:
-                        total = next(self)
-                        filename_reg = {self._data_path(total % self.groups): total}
-                for filename in filename_reg:
-                    if data["action"] != "insert":
-                        while True:
-                            try:
-                                if data["action"] != "fetch":
-                                    self.__getattribute__("_{}".format(data["action"]))(data["data"],
-                                                                                        filename_reg[filename],
-                                                                                        filename)
-                            except (KeyboardInterrupt, SystemExit):
-                                raise
-                            except Exception as e:
-                                print(e)
-                                raise
-                                time.sleep(0.1)
-                                continue
-                            else:
-                                break
+                        break
+        if data["action"] == "insert":
+            self._insert(data["data"], filename_reg)
+        if self._to_block is True:
+            if data["action"] != "insert":
+                if data["action"] == "new":
+                    s_filter = {"_id": total}
+                else:
+                    s_filter = data["filter"]
+            if data["action"] in ("new", "drop", "edit", "replace", "insert", "fetch"):
                 if data["action"] == "insert":
-                    self._insert(data["data"], filename_reg)
-                if self._to_block is True:
-                    if data["action"] != "insert":
-                        if data["action"] == "new":
-                            s_filter = {"_id": total}
-                        else:
-                            s_filter = data["filter"]
-                    if data["action"] in ("new", "drop", "edit", "replace", "insert", "fetch"):
-                        if data["action"] == "insert":
-                           send = None
-                        elif data["action"] == "fetch":
-                            send =  self.direct_fetch(s_filter)
-                        else:
-                            try:
-                                fetched = self.direct_fetch(s_filter)
-                                send = fetched
-                                """After an edit or a replace filter may change...
-                                   Is it a bug?"""
-                            except KeyError:
-                                send = None
-                        if send is None:
-                            if data["action"] in ("new", "insert"):
-                                filtered = {"total": 1,
-                                            "page": 1,
-                                            "items_per_page": self.items_per_page}
-                            send = {"data": [],
-                                    "total": filtered["total"],
-                                    "page": filtered["page"],
-                                    "items_per_page": filtered["items_per_page"]}
+                   send = None
+                elif data["action"] == "fetch":
+                    send =  self.direct_fetch(s_filter)
                 else:
-                    send = None
-                self._alive = False
-                data["pipe"].send(send)
-                #TODO: send error
+                    try:
+                        fetched = self.direct_fetch(s_filter)
+                        send = fetched
+                        """After an edit or a replace filter may change...
+                           Is it a bug?"""
+                    except KeyError:
+                        send = None
+                if send is None:
+                    if data["action"] in ("new", "insert"):
+                        filtered = {"total": 1,
+                                    "page": 1,
+                                    "items_per_page": self.items_per_page}
+                    send = {"data": [],
+                            "total": filtered["total"],
+                            "page": filtered["page"],
+                            "items_per_page": filtered["items_per_page"]}
+        else:
+            send = None
+        return send
 
     def close(self):
         """
@@ -827,6 +1445,28 @@ class ShelveModel(RestfulBaseInterface):
             time.sleep(0.5)
         self.writer.join()
 
+    def reopen(self):
+        """
+        Starts a new writer when the model is used in a forked process, where
+        the writer thread of the parent does not exist. It does nothing in the
+        process the model was created or reopened in.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._close_handles(discard=True) # Their files are written by the writer of the parent
+        self._session_owner = None
+        self._session_locks = list()
+        self._session_paths = set()
+        self._handles_lock = threading.Lock()
+        self._generation = 0
+        self._local = threading.local()
+        self._counters = None
+        self._counters_changed = False
+        self._pipe_in, self._pipe_out = Pipe(False)
+        self._close = False
+        self.writer = self._writer()
+
     def _set_as_foreign(self, foreign_key):
         self._as_foreign.append(foreign_key)
 
@@ -839,6 +1479,9 @@ class ShelveForeign(RestfulBaseInterface):
     Foreign Key for ShelveModel. Too Cute to Be.
 
     """
+    cacheable = True
+    native = True
+
     def __init__(self, foreign_model, child_model, child_field, alias="_id", items_per_page=50):
         """
         Instantiates ShelveForeign
@@ -900,6 +1543,12 @@ class ShelveForeign(RestfulBaseInterface):
         return {"foreign": foreign_filter,
                 "child": child_filter}
 
+    def get_version(self):
+        foreign, child = self.foreign.get_version(), self.child.get_version()
+        if foreign is None or child is None:
+            return None
+        return "{}.{}".format(foreign, child)
+
     def _unfilter_child(self, filter):
         final = dict()
         for key in filter:
@@ -1036,6 +1685,8 @@ class ShelveBlocking(ShelveModel):
     To use with zrest.
 
     """
+    cacheable = False # Every fetch blocks registries
+
     def __init__(self, filepath, blocker=None, groups=10, *, index_fields=None,
                                                              headers=None,
                                                              name=None,
@@ -1074,6 +1725,9 @@ class ShelveBlocking(ShelveModel):
     def timeout(self):
         return datetime.datetime.now()+datetime.timedelta(minutes=25)
 
+    def get_version(self): # Every fetch blocks registries, it can't be skipped
+        return None
+
     def is_blocked(self, filter, blocker, **kwargs):
         filtered = self._filter(filter)
         s_filter = filtered["filter"]
@@ -1134,6 +1788,17 @@ class ShelveBlocking(ShelveModel):
                                           "timeout": self.timeout()})
                 return ShelveModel.replace(self, {"_id": item}, data)
 
+    def bulk(self, operations, **kwargs):
+        """
+        Applies each write by the method of its action, as they have to go
+        through the blocks of registries.
+        :param operations: list of tuples with action, filter and data
+        :returns: list with the result of each operation
+
+        """
+        return [self.__getattribute__(action)(filter=filter, data=data)
+                for action, filter, data in operations]
+
     def unblock_registry(self, filter=None):
         if filter is not None and "_blocker" in filter:
             blocker = filter["_blocker"]
@@ -1193,4 +1858,8 @@ class ShelveBlocking(ShelveModel):
 
     def close(self):
         self._blocking_model.close()
-        ShelveModel.close(self)
\ No newline at end of file
+        ShelveModel.close(self)
+
+    def reopen(self):
+        self._blocking_model.reopen()
+        ShelveModel.reopen(self)
\ No newline at end of file
@@ -0,0 +1,203 @@
+"""
+Metrics
+
+Counters and latency histograms of the requests served by App, by route
+(the uri patterns of the app) and verb, with the time spent in each phase
+of a request: parse_uri, model, hal and write. They are given in the
+Prometheus text format.
+
+Each process has its own metrics, so with several workers each one gives
+the requests it has served.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+__all__ = ["Metrics",
+           "Histogram"]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return ",".join(['{}="{}"'.format(name, _escape(labels[name])) for name in labels])
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds.
+
+    :method observe: Counts a duration.
+    :method render: Gives the lines of the histogram in Prometheus format.
+
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0 for bucket in buckets]
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for index, bucket in enumerate(self.buckets):
+            if seconds <= bucket:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def render(self, name, labels):
+        """
+        Gives the lines of the histogram, with cumulative buckets.
+
+        :param name: name of the metric
+        :param labels: labels of the histogram, already formatted
+        :returns: list of str
+
+        """
+        lines = list()
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bucket, cumulative))
+        lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count))
+        lines.append("{}_sum{{{}}} {}".format(name, labels, self.sum))
+        lines.append("{}_count{{{}}} {}".format(name, labels, self.count))
+        return lines
+
+
+class Metrics:
+    """
+    Metrics of the requests served by App.
+
+    The Handler starts a record for each request with start and ends it
+    with finish. Meanwhile App sets its route and adds the time of each
+    phase from the same thread.
+
+    :method start: Starts the record of a request in this thread.
+    :method set_route: Sets the route of the request being recorded.
+    :method phase: Context manager adding the time spent to a phase.
+    :method add_phase: Adds time spent to a phase.
+    :method finish: Ends the record of a request and counts it.
+    :method render: Gives every metric in Prometheus text format.
+    :method reset: Forgets every metric.
+
+    """
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        """
+        Initializes Metrics
+
+        :param buckets: upper bounds in seconds of the latency histograms.
+                        Metrics.buckets if None.
+
+        """
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = dict()  # (route, verb, status): count
+            self._latency = dict()  # (route, verb): Histogram
+            self._phases = dict()  # (route, verb, phase): Histogram
+
+    def start(self):
+        self._local.record = {"route": None,
+                              "start": time.perf_counter(),
+                              "phases": dict()}
+
+    def _record(self):
+        return getattr(self._local, "record", None)
+
+    def set_route(self, route):
+        """
+        Sets the route of the request being recorded. Only the first route
+        set is kept, as App.action may be called several times by request.
+
+        """
+        record = self._record()
+        if record is not None and record["route"] is None:
+            record["route"] = route
+
+    def add_phase(self, phase, seconds):
+        record = self._record()
+        if record is not None:
+            record["phases"][phase] = record["phases"].get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(phase, time.perf_counter() - start)
+
+    def finish(self, verb, status):
+        """
+        Ends the record of the request of this thread and counts it.
+
+        :param verb: verb of the request
+        :param status: status code of the response
+
+        """
+        record = self._record()
+        if record is None:
+            return
+        self._local.record = None
+        seconds = time.perf_counter() - record["start"]
+        route = record["route"] if record["route"] is not None else "unmatched"
+        with self._lock:
+            key = (route, verb, int(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if (route, verb) not in self._latency:
+                self._latency[(route, verb)] = Histogram(self.buckets)
+            self._latency[(route, verb)].observe(seconds)
+            for phase in record["phases"]:
+                if (route, verb, phase) not in self._phases:
+                    self._phases[(route, verb, phase)] = Histogram(self.buckets)
+                self._phases[(route, verb, phase)].observe(record["phases"][phase])
+
+    def render(self, gauges=None):
+        """
+        Gives every metric in Prometheus text format.
+
+        :param gauges: dictionary with a prefix and a dictionary of values
+                       for each group of gauges to add, as
+                       {"zrest_cache": {"hits": 10}}. Values which are not
+                       numbers are skipped.
+        :returns: str
+
+        """
+        lines = list()
+        with self._lock:
+            lines.append("# HELP zrest_requests_total Requests served by route, verb and status code.")
+            lines.append("# TYPE zrest_requests_total counter")
+            for route, verb, status in sorted(self._requests):
+                lines.append("zrest_requests_total{{{}}} {}".format(
+                        _labels(route=route, verb=verb, status=status),
+                        self._requests[(route, verb, status)]))
+            lines.append("# HELP zrest_request_duration_seconds Time to serve requests by route and verb.")
+            lines.append("# TYPE zrest_request_duration_seconds histogram")
+            for route, verb in sorted(self._latency):
+                lines.extend(self._latency[(route, verb)].render("zrest_request_duration_seconds",
+                                                                 _labels(route=route, verb=verb)))
+            lines.append("# HELP zrest_phase_duration_seconds Time spent in each phase of requests.")
+            lines.append("# TYPE zrest_phase_duration_seconds histogram")
+            for route, verb, phase in sorted(self._phases):
+                lines.extend(self._phases[(route, verb, phase)].render("zrest_phase_duration_seconds",
+                                                                       _labels(route=route, verb=verb,
+                                                                               phase=phase)))
+        if gauges is not None:
+            for prefix in gauges:
+                for name in sorted(gauges[prefix]):
+                    value = gauges[prefix][name]
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    lines.append("# TYPE {}_{} gauge".format(prefix, name))
+                    lines.append("{}_{} {}".format(prefix, name, value))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,108 @@
+"""
+ThreadPoolMixIn
+
+Mix-in for socketserver servers, as socketserver.ThreadingMixIn, which
+serves connections from a fixed amount of threads fed by a bounded queue.
+When the queue is full, connections are answered right away with
+503 - Service Unavailable and a Retry-After header instead of piling up.
+"""
+import threading
+import queue
+
+__all__ = ["ThreadPoolMixIn"]
+
+
+class ThreadPoolMixIn:
+    """
+    Mix-in class to handle each request in a pool of threads.
+
+    :attr pool_size: amount of threads serving connections.
+    :attr queue_size: accepted connections waiting for a thread.
+    :attr retry_after: seconds sent in Retry-After when rejecting.
+    :property stats: dictionary with pool and queue counters.
+
+    Note that a persistent connection keeps its thread until it is closed or
+    its idle timeout expires.
+
+    """
+    pool_size = 16
+    queue_size = 64
+    retry_after = 1
+    daemon_threads = True
+
+    def _start_pool(self):
+        if getattr(self, "_pool", None):
+            return
+        self._queue = queue.Queue(self.queue_size)
+        self._counters_lock = threading.Lock()
+        self._counters = {"processed": 0,
+                          "rejected": 0,
+                          "busy": 0}
+        self._pool = list()
+        for index in range(0, self.pool_size):
+            thread = threading.Thread(target=self._pool_worker, daemon=self.daemon_threads)
+            thread.start()
+            self._pool.append(thread)
+
+    def _count(self, name, value=1):
+        with self._counters_lock:
+            self._counters[name] += value
+
+    @property
+    def stats(self):
+        if not getattr(self, "_pool", None):
+            return dict()
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats.update({"pool_size": self.pool_size,
+                      "queue_size": self.queue_size,
+                      "queue_depth": self._queue.qsize()})
+        return stats
+
+    def serve_forever(self, *args, **kwargs):
+        self._start_pool() # Started here so forked workers have their own
+        super().serve_forever(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self._reject(request)
+
+    def _reject(self, request):
+        self._count("rejected")
+        try:
+            request.settimeout(1)
+            request.sendall("HTTP/1.1 503 Service Unavailable\r\n"
+                            "Retry-After: {}\r\n"
+                            "Content-Length: 0\r\n"
+                            "Connection: close\r\n\r\n".format(self.retry_after).encode("ascii"))
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def _pool_worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            self._count("busy")
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self._count("busy", -1)
+                self._count("processed")
+
+    def server_close(self):
+        super().server_close()
+        if getattr(self, "_pool", None):
+            for thread in self._pool:
+                self._queue.put(None)
+            for thread in self._pool:
+                thread.join()
+            self._pool = list()
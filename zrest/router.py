@@ -0,0 +1,172 @@
+"""
+Router
+
+Route table used by App to resolve request paths to the uris given to
+set_model and set_method. Routes are bucketed by their first static path
+segment, so resolving a path only tries the few patterns that may match it,
+and recently resolved paths are kept in a LRU cache.
+
+LinkTemplate compiles the same uris into formatters for HAL links.
+"""
+from collections import OrderedDict
+import threading
+import re
+
+__all__ = ["Router",
+           "LinkTemplate"]
+
+_static_segment = re.compile(r"^\^?/([\w\-~]+)(?=/|\$|$)")
+_params_searcher = re.compile(r"<(?P<param>[\w]*)>")
+
+
+class Router:
+    """
+    Compiled route table.
+
+    :method add: Registers an uri in regular expression format.
+    :method resolve: Gives the uri and the groups matching a path.
+    :method clear_cache: Empties the LRU of resolved paths.
+
+    """
+    def __init__(self, cache_size=1024):
+        """
+        Initializes Router
+
+        :param cache_size: amount of resolved paths to keep in memory.
+                           0 disables the cache.
+
+        """
+        self._routes = OrderedDict()  # uri: (compiled, order, priority)
+        self._buckets = dict()
+        self._wildcards = list()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __contains__(self, uri):
+        return uri in self._routes
+
+    @staticmethod
+    def _priority(uri, compiled):
+        """
+        Priority used to choose between several matching uris. Same criteria
+        App.parse_uri used: the latest first group wins and, on equality,
+        the uri with less groups.
+
+        """
+        position = uri.find("(?P<")
+        return (position, -compiled.groups)
+
+    def add(self, uri, flags=re.IGNORECASE):
+        """
+        Registers an uri in the route table.
+
+        :param uri: uri in regular expression format, as built by set_model.
+        :param flags: flags to compile the uri with.
+        :returns: compiled expression
+        :raises: re.error if uri is not a valid expression
+
+        """
+        with self._lock:
+            if uri in self._routes:
+                return self._routes[uri][0]
+            compiled = re.compile(uri, flags)
+            route = (compiled, len(self._routes), self._priority(uri, compiled))
+            self._routes[uri] = route
+            segment = _static_segment.match(uri)
+            if segment is not None:
+                key = segment.group(1).lower()
+                if key not in self._buckets:
+                    self._buckets[key] = list()
+                self._buckets[key].append(uri)
+            else:
+                self._wildcards.append(uri)
+            self._cache.clear()
+            return compiled
+
+    def _candidates(self, path):
+        segment = path.lstrip("/").split("/", 1)[0].lower()
+        return self._buckets.get(segment, list()) + self._wildcards
+
+    def resolve(self, path):
+        """
+        Gives the uri matching given path.
+
+        :param path: path of the request, without query.
+        :returns: tuple with uri and a new dictionary with its groups or
+                  None if no uri matches.
+
+        """
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                uri, groups = self._cache[path]
+                return uri, dict(groups)
+        matched = None
+        for uri in self._candidates(path):
+            compiled, order, priority = self._routes[uri]
+            data = compiled.match(path)
+            if data is None:
+                continue
+            if matched is None or priority > matched[1] or (
+                    priority == matched[1] and order < matched[2]):
+                matched = (uri, priority, order, data.groupdict())
+        if matched is None:
+            return None
+        uri, groups = matched[0], matched[3]
+        if self._cache_size:
+            with self._lock:
+                self._cache[path] = (uri, groups)
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return uri, dict(groups)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class LinkTemplate:
+    """
+    Uri given to set_model, as r"/model/<_id>", split once in its static
+    pieces and its params, so links are built without regular expressions.
+
+    :method expand: Gives the href of the uri for given values.
+
+    """
+    def __init__(self, uri):
+        """
+        Initializes LinkTemplate
+
+        :param uri: uri with params between "<" and ">"
+
+        """
+        self.uri = uri
+        pieces = _params_searcher.split(uri.strip("^").strip("$"))
+        self._static = pieces[0::2]
+        self.params = tuple(pieces[1::2])
+        self._pairs = tuple(zip(self.params, self._static[1:]))
+
+    def expand(self, values):
+        """
+        Gives the href of the uri, with its params replaced by given values.
+        Params without value are left as they are.
+
+        :param values: dictionary with the value of each param
+        :returns: href or None if no param has a value
+
+        """
+        found = False
+        href = [self._static[0]]
+        for param, static in self._pairs:
+            if param in values:
+                href.append(str(values[param]))
+                found = True
+            else:
+                href.append("<{}>".format(param))
+            href.append(static)
+        if found is True:
+            return "".join(href)
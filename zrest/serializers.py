@@ -0,0 +1,135 @@
+"""
+Serializers
+
+Encoding of requests and responses. Every serializer encodes objects to
+bytes and decodes bytes, bytearray, memoryview or str. Values of datetime,
+date and time are encoded in ISO 8601 and timedelta as seconds.
+
+The fastest installed backend is used by default: orjson if it is
+available, the standard json module otherwise.
+"""
+import datetime
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ["JSONSerializer",
+           "OrjsonSerializer",
+           "SERIALIZERS",
+           "get_serializer"]
+
+
+def _default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+class JSONSerializer:
+    """
+    Serializer based on the standard json module.
+
+    :method encode: Gives bytes of given object.
+    :method iter_encode: Gives bytes of given HAL document by pieces.
+    :method decode: Gives object of given bytes.
+
+    """
+    name = "json"
+    content_type = "application/json"
+
+    def encode(self, data):
+        return json.dumps(data, default=_default).encode("utf-8")
+
+    def iter_encode(self, data, chunk_size=64*1024):
+        """
+        Encodes a HAL document by pieces of about chunk_size bytes. Lists in
+        "_embedded" are encoded item by item, so the whole document is never
+        held encoded in memory.
+
+        :param data: object to encode
+        :param chunk_size: minimum size of each piece but the last one
+        :returns: generator of bytes
+
+        """
+        if not isinstance(data, dict) or not isinstance(data.get("_embedded"), dict):
+            yield self.encode(data)
+            return
+        buffer = bytearray(b"{")
+        for index, key in enumerate(data):
+            if index:
+                buffer += b","
+            buffer += self.encode(str(key)) + b":"
+            if key != "_embedded":
+                buffer += self.encode(data[key])
+                continue
+            buffer += b"{"
+            for embedded_index, name in enumerate(data[key]):
+                if embedded_index:
+                    buffer += b","
+                buffer += self.encode(str(name)) + b":"
+                items = data[key][name]
+                if not isinstance(items, list):
+                    buffer += self.encode(items)
+                    continue
+                buffer += b"["
+                for item_index, item in enumerate(items):
+                    if item_index:
+                        buffer += b","
+                    buffer += self.encode(item)
+                    if len(buffer) >= chunk_size:
+                        yield bytes(buffer)
+                        buffer.clear()
+                buffer += b"]"
+            buffer += b"}"
+        buffer += b"}"
+        yield bytes(buffer)
+
+    def decode(self, data):
+        if isinstance(data, (memoryview, bytearray)):
+            data = bytes(data)
+        return json.loads(data)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Serializer based on orjson, if installed.
+
+    """
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+
+    def encode(self, data):
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+SERIALIZERS = {"json": JSONSerializer}
+if orjson is not None:
+    SERIALIZERS["orjson"] = OrjsonSerializer
+
+
+def get_serializer(name=None):
+    """
+    Gives a serializer instance.
+
+    :param name: name of the backend in SERIALIZERS. If None, the fastest
+                 installed backend.
+    :returns: serializer instance
+    :raises: KeyError if name is not available
+
+    """
+    if name is None:
+        name = "orjson" if "orjson" in SERIALIZERS else "json"
+    return SERIALIZERS[name]()
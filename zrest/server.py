@@ -2,15 +2,34 @@ from zrest.statuscodes import *
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
 from .basedatamodel import RestfulBaseInterface
+from .router import Router, LinkTemplate
+from .asyncserver import AsyncServer
+from .pool import ThreadPoolMixIn
+from .cache import ResponseCache
+from .metrics import Metrics
+from .tracing import tracer
+from contextlib import contextmanager
+from .serializers import get_serializer
 from .statuscodes import *
 from zashel.utils import threadize, daemonize
 from urllib.parse import urlparse, parse_qsl
+from collections import OrderedDict
 from math import ceil
 import re
 import json
+import zlib
+import csv
+import io
 import ssl
 import os
 import time
+import signal
+import threading
+import traceback
+import cProfile
+import pstats
+import hmac
+import uuid
 
 GET = "GET"
 POST = "POST"
@@ -27,6 +46,10 @@ ALL = [GET,
        DELETE,
        LOAD,
        COUNT]
+BULK_ACTIONS = {POST: "new", # Verbs of writes which models may group
+                PUT: "replace",
+                PATCH: "edit",
+                DELETE: "drop"}
 
 def not_implemented(*args, **kwargs):
     """
@@ -37,6 +60,22 @@ def not_implemented(*args, **kwargs):
     """
     return json.dumps({"Error": "501"})
 
+class _BodyWriter(io.RawIOBase):
+    """
+    Writable file over the body of a response being sent by a Handler.
+
+    """
+    def __init__(self, handler):
+        self._handler = handler
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._handler._write_body(bytes(data))
+        return len(data)
+
+
 class Handler(BaseHTTPRequestHandler):
     """
     Base Handler for ZRest APP. It can be subclassed to implement exceptions
@@ -55,8 +94,16 @@ class Handler(BaseHTTPRequestHandler):
     :method do_PUT: calls _prepare with no other parameter than a PUT action.
     :method do_PATCH: calls _prepare with no other paramenter than a PATCH action.
     :method do_DELETE: calls _prepare with no other paramenter than a DELETE action.
+    :method set_keep_alive: class method to configure persistent connections.
 
     """
+    protocol_version = "HTTP/1.1"
+    timeout = 15 # Seconds an idle connection is kept open
+    max_requests = 100 # Requests served by a connection before closing it
+    stream_min_items = 100 # Embedded items from which a response is sent chunked
+    stream_chunk_size = 64*1024
+    load_batch_size = 1000 # Records given to the model each time on a ndjson LOAD
+
     @property
     def rest_app(self):
         """
@@ -74,6 +121,21 @@ class Handler(BaseHTTPRequestHandler):
         """
         cls._rest_app = app
 
+    @classmethod
+    def set_keep_alive(cls, enabled=True, timeout=15, max_requests=100):
+        """
+        Configures persistent connections of the handler.
+        :param enabled: if False, every connection is closed after its
+                        response, as in HTTP/1.0.
+        :param timeout: seconds an idle connection is kept open.
+        :param max_requests: requests served by a connection before
+                             closing it.
+
+        """
+        cls.protocol_version = "HTTP/1.1" if enabled is True else "HTTP/1.0"
+        cls.timeout = timeout
+        cls.max_requests = max_requests
+
     def _prepare(self, action, response_default=200):
         """
         Prepares and sends requested data to client.
@@ -83,69 +145,319 @@ class Handler(BaseHTTPRequestHandler):
                                  goes alright. 200 - OK by default.
 
         """
+        metrics = self.rest_app.metrics
+        metrics.start()
+        self._trace_id = tracer.start_trace("{} {}".format(action, self.path),
+                                            force=tracer.enabled and self.headers["X-Trace"] == "1")
+        self._status = None
+        self._write_start = None
+        try:
+            self._serve(action, response_default)
+        finally:
+            if self._write_start is not None:
+                metrics.add_phase("write", time.perf_counter()-self._write_start)
+                tracer.add_span("write", self._write_start, time.perf_counter())
+            metrics.finish(action, self._status or 500)
+            tracer.finish_trace(status=self._status or 500)
+
+    def _serve(self, action, response_default):
+        if (action == LOAD and self.headers["Content-Type"] is not None and
+                self.headers["Content-Type"].startswith("application/x-ndjson")):
+            self._load_stream()
+            return
+        body = b"".join(self._read_body()) # Always consumed to keep framing
+        if (action == GET and self.headers["Content-Type"] is not None and
+                self.headers["Content-Type"].startswith("text/csv")):
+            rows = self.rest_app.export(self.path)
+            if rows is not None:
+                self._send_export(rows)
+                return
         if action in (POST, PUT, PATCH, LOAD):
-            data = self.rfile.read(int(self.headers["Content-Length"]))
-            data = data.decode("utf-8") #To be changed
-            data = self.rest_app.action(action, self.path, data=data)
+            data = self.rest_app.action(action, self.path, headers=self.headers, data=body)
         else:
-            data = self.rest_app.action(action, self.path)
+            data = self.rest_app.action(action, self.path, headers=self.headers)
         response = data["response"]
         if response == 0:
             response = response_default
+        if response == 304:
+            headers = self.rest_app.headers.copy()
+            headers.update(data["headers"])
+            self._count_request()
+            self._send_headers(response, headers)
+            return
         if not data["payload"] and action in (GET, NEXT):
             response = 404
-        self.send_response(response, get_code(response).text)
-        #self.send_header("Content-Type", "application/json; charset=utf-8")
         headers =  self.rest_app.headers.copy()
         headers.update(data["headers"])
-        if (("Content-Type" in self.headers and
-                self.headers["Content-Type"].startswith("application/json")) or
-                self.headers["Content-Type"] is None):
-            for header in headers:
-                self.send_header(header, headers[header])
-            self.end_headers()
-            if data["payload"]:
-                self.wfile.write(bytearray(json.dumps(data["payload"]), "utf-8"))
-        elif (("Content-Type" in self.headers and
-                self.headers["Content-Type"].startswith("text/csv") and action == GET) or
-                self.headers["Content-Type"] is None):
+        self._count_request()
+        encoding = self._accepted_encoding()
+        if self.rest_app.compression["level"]:
+            headers["Vary"] = "Accept-Encoding"
+        if (self.headers["Content-Type"] is not None and
+                self.headers["Content-Type"].startswith("text/csv") and action == GET):
             headers.update({"Content-Type": "text/csv; charset=utf-8"})
-            for header in headers:
-                self.send_header(header, headers[header])
-            self.end_headers()
-            headers = list() #These are other headers
+            self._send_headers(response, headers, encoding=encoding)
+            self._send_csv(action, data)
+            self._end_body()
+        elif self._embedded_items(data["payload"]) >= self.stream_min_items:
+            self._send_headers(response, headers, encoding=encoding)
+            for piece in self.rest_app.serializer.iter_encode(data["payload"], self.stream_chunk_size):
+                self._write_body(piece)
+            self._end_body()
+        else:
+            payload = bytes()
+            if isinstance(data["payload"], bytes): # Already encoded, as metrics
+                payload = data["payload"]
+            elif data["payload"] and response not in (204, 304):
+                payload = self.rest_app.serializer.encode(data["payload"])
+            if encoding is not None and len(payload) >= self.rest_app.compression["min_size"]:
+                compressor = self._compressor(encoding)
+                payload = compressor.compress(payload) + compressor.flush()
+                headers["Content-Encoding"] = encoding
+                if "ETag" in headers: # Each coding is a different representation
+                    headers["ETag"] = '{}-{}"'.format(headers["ETag"][:-1], encoding)
+            self._send_headers(response, headers, len(payload))
+            self.wfile.write(payload)
+
+    @staticmethod
+    def _embedded_items(payload):
+        if not isinstance(payload, dict) or not isinstance(payload.get("_embedded"), dict):
+            return 0
+        return sum([len(items) for items in payload["_embedded"].values() if isinstance(items, list)])
+
+    def _accepted_encoding(self):
+        """
+        Chooses the content coding of the response from Accept-Encoding.
+        :returns: "gzip", "deflate" or None if response is not to be compressed
+
+        """
+        accept = self.headers["Accept-Encoding"]
+        if not accept or not self.rest_app.compression["level"]:
+            return None
+        qualities = dict()
+        for item in accept.split(","):
+            name, sep, params = item.partition(";")
+            quality = 1.0
+            for param in params.split(";"):
+                key, sep, value = param.partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[name.strip().lower()] = quality
+        chosen = None
+        for encoding in self.rest_app.compression["encodings"]:
+            quality = qualities.get(encoding, qualities.get("*", 0.0))
+            if quality > 0 and (chosen is None or quality > chosen[1]):
+                chosen = (encoding, quality)
+        if chosen is not None:
+            return chosen[0]
+
+    def _compressor(self, encoding):
+        wbits = {"gzip": 31, "deflate": 15}[encoding]
+        return zlib.compressobj(self.rest_app.compression["level"], zlib.DEFLATED, wbits)
+
+    def _read_body(self, size=64*1024):
+        """
+        Reads the body of the request by pieces, framed by Content-Length or
+        sent chunked.
+
+        :param size: maximum size of each piece
+        :returns: generator of bytes
+
+        """
+        if "chunked" in (self.headers["Transfer-Encoding"] or "").lower():
             while True:
-                if data["payload"]:
-                    json_data = data["payload"]
-                    if "_embedded" in json_data:
-                        embedded = json_data["_embedded"]
-                        for item in embedded:
-                            print("Embedded {}".format(embedded))
-                            for index, row in enumerate(embedded[item]):
-                                if "prev" not in json_data["_links"] and index == 0:
-                                    for header in row:
-                                        if header != "_links":
-                                            headers.append(header)
-                                    headers.sort()
-                                    self.wfile.write(bytearray(";".join(headers)+"\n", "utf-8"))
-                                self.wfile.write(bytearray(
-                                        ";".join([str(row[header]) for header in headers]) + "\n",
-                                        "utf-8")
-                                        )
-                    else:
-                        for header in json_data:
-                            if header != "_links":
-                                headers.append(header)
-                            headers.sort()
-                            self.wfile.write(bytearray(";".join(headers) + "\n", "utf-8"))
-                        self.wfile.write(bytearray(
-                            ";".join([str(json_data[header]) for header in headers]) + "\n",
-                            "utf-8")
-                        )
-                    if "next" in json_data["_links"]:
-                        data = self.rest_app.action(action, json_data["_links"]["next"]["href"])
-                    else:
-                        break
+                length = int(self.rfile.readline(65537).split(b";")[0].strip(), 16)
+                if length == 0:
+                    while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""): # Trailers
+                        pass
+                    break
+                while length > 0:
+                    piece = self.rfile.read(min(size, length))
+                    if not piece:
+                        return
+                    length -= len(piece)
+                    yield piece
+                self.rfile.readline(65537)
+        else:
+            length = int(self.headers["Content-Length"] or 0)
+            while length > 0:
+                piece = self.rfile.read(min(size, length))
+                if not piece:
+                    return
+                length -= len(piece)
+                yield piece
+
+    def _read_lines(self):
+        """
+        Reads the body of the request line by line.
+
+        :returns: generator of bytes without line ends
+
+        """
+        rest = bytes()
+        for piece in self._read_body():
+            lines = (rest + piece).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if rest:
+            yield rest
+
+    def _load_stream(self):
+        """
+        Loads a body of newline delimited json in batches, answering with a
+        line of newline delimited json for each batch and a final summary.
+
+        """
+        headers = self.rest_app.headers.copy()
+        headers.update({"Content-Type": "application/x-ndjson; charset=utf-8"})
+        self._count_request()
+        lines = self._read_lines()
+        acks = self.rest_app.ingest(self.path, lines, self.load_batch_size)
+        try:
+            self._send_headers(201, headers)
+            for ack in acks:
+                self._write_body(self.rest_app.serializer.encode(ack) + b"\n")
+            self._end_body()
+        finally:
+            for line in lines: # Keeps framing if something went wrong
+                pass
+
+    def _count_request(self):
+        """
+        Counts the request in the connection, closing it once max_requests
+        have been served.
+
+        """
+        self._requests = getattr(self, "_requests", 0) + 1
+        if self._requests >= self.max_requests:
+            self.close_connection = True
+
+    def _send_headers(self, response, headers, length=None, encoding=None):
+        """
+        Sends response line and headers, framing the body to come.
+        :param response: status code
+        :param headers: dictionary with headers
+        :param length: length of the body. If None, body is sent chunked
+                       or, on HTTP/1.0, until the connection is closed.
+        :param encoding: content coding to compress a body sent without
+                         length with. None by default.
+
+        """
+        self._status = response
+        self._write_start = time.perf_counter()
+        self.send_response(response, get_code(response).text)
+        self._chunked = False
+        self._body_compressor = None
+        if length is None and encoding is not None:
+            headers = dict(headers)
+            headers["Content-Encoding"] = encoding
+            if "ETag" in headers:
+                headers["ETag"] = '{}-{}"'.format(headers["ETag"][:-1], encoding)
+            self._body_compressor = self._compressor(encoding)
+        for header in headers:
+            self.send_header(header, headers[header])
+        if getattr(self, "_trace_id", None) is not None:
+            self.send_header("X-Trace-Id", self._trace_id)
+        if response in (204, 304): # Without body
+            pass
+        elif length is not None:
+            self.send_header("Content-Length", str(length))
+        elif self.request_version == "HTTP/1.1" and self.protocol_version == "HTTP/1.1":
+            self.send_header("Transfer-Encoding", "chunked")
+            self._chunked = True
+        else:
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+
+    def _write_body(self, data):
+        """
+        Writes a piece of a body sent by _send_headers without length.
+
+        """
+        if self._body_compressor is not None:
+            data = self._body_compressor.compress(data)
+        if not data:
+            return
+        if self._chunked is True:
+            self.wfile.write("{:X}\r\n".format(len(data)).encode("ascii"))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+        else:
+            self.wfile.write(data)
+
+    def _end_body(self):
+        if self._body_compressor is not None:
+            compressor, self._body_compressor = self._body_compressor, None
+            self._write_body(compressor.flush())
+        if self._chunked is True:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _send_export(self, rows):
+        """
+        Sends as CSV all rows given by App.export, through a buffered writer.
+        Columns are the sorted fields of the first row, as in _send_csv.
+
+        """
+        headers = self.rest_app.headers.copy()
+        headers.update({"Content-Type": "text/csv; charset=utf-8"})
+        if self.rest_app.compression["level"]:
+            headers["Vary"] = "Accept-Encoding"
+        self._count_request()
+        self._send_headers(200, headers, encoding=self._accepted_encoding())
+        stream = io.TextIOWrapper(io.BufferedWriter(_BodyWriter(self), self.stream_chunk_size),
+                                  encoding="utf-8", newline="")
+        writer = csv.writer(stream, delimiter=";", lineterminator="\n")
+        fields = None
+        for row in rows:
+            if fields is None:
+                fields = sorted([field for field in row if field != "_links"])
+                writer.writerow(fields)
+            writer.writerow([row.get(field, "") for field in fields])
+        stream.flush()
+        stream.detach()
+        self._end_body()
+
+    def _send_csv(self, action, data):
+        headers = list() #These are other headers
+        while True:
+            if data["payload"]:
+                json_data = data["payload"]
+                if "_embedded" in json_data:
+                    embedded = json_data["_embedded"]
+                    for item in embedded:
+                        for index, row in enumerate(embedded[item]):
+                            if "prev" not in json_data["_links"] and index == 0:
+                                for header in row:
+                                    if header != "_links":
+                                        headers.append(header)
+                                headers.sort()
+                                self._write_body(bytearray(";".join(headers)+"\n", "utf-8"))
+                            self._write_body(bytearray(
+                                    ";".join([str(row[header]) for header in headers]) + "\n",
+                                    "utf-8")
+                                    )
+                else:
+                    for header in json_data:
+                        if header != "_links":
+                            headers.append(header)
+                        headers.sort()
+                        self._write_body(bytearray(";".join(headers) + "\n", "utf-8"))
+                    self._write_body(bytearray(
+                        ";".join([str(json_data[header]) for header in headers]) + "\n",
+                        "utf-8")
+                    )
+                if "next" in json_data["_links"]:
+                    data = self.rest_app.action(action, json_data["_links"]["next"]["href"])
+                else:
+                    break
+            else:
+                break
 
     def do_GET(self):
         """
@@ -225,15 +537,30 @@ class App:
 
     :method set_header: Sets a single header with given information.
     :method set_headers: Updates headers dictionary with given dictionary.
+    :method set_compression: Configures compression of responses.
+    :method set_serializer: Sets the serializer of requests and responses.
     :method parse_uri: Gives a dictionary with uri's information to use in
                        diverse methods.
     :method get_model: Gives model by name.
     :method set_model: Sets a new model in app with given information.
     :method set_method: Sets a single method to a single verb call.
     :method action: Decides how to show requested query.
+    :method export: Iterates every item of a query, without pages.
+    :method ingest: Loads records in batches.
+    :method batch: Runs several operations given in a single request.
+    :method set_batch_uri: Sets the uri of batches of operations.
+    :method set_metrics_uri: Sets the uri of metrics of requests.
+    :method set_tracing: Enables tracing of a sample of requests.
+    :method set_profiling: Enables profiling of requests given a token.
+    :method get_profile: Gives a stored profile of a request.
+    :property metrics: Metrics of requests served by the application.
+    :method set_cache: Enables a cache of GET responses.
+    :method get_cache_stats: Gives counters of the cache of responses.
     :method set_ssl: Sets defined key and cert in socket to ssl connections
     :method run_thread: Runs Application in a separate thread.
     :method run: Runs application.
+    :method get_server_stats: Gives counters of the running server.
+    :method run_async: Runs application on an asyncio event loop.
     :method shutdown: Safe shutdown of all threads.
                       Called by default by __del__.
 
@@ -244,15 +571,31 @@ class App:
         self._orig_uri = dict()
         self._name_by_uri = dict()
         self._simple_uri_by_name = dict()
+        self._link_templates = dict()
+        self._location_params = dict()
         self._params = dict()
         self._handler = handler
         self._handler.set_app(self)
         self._server = None
-        self._re = dict()
+        self._workers = list()
+        self._stopping = False
+        self._router = Router()
         self._params_searcher = re.compile(r"<(?P<param>[\w]*)>")
         self._key, self._cert = None, None
         self._headers = {"Content-Type": "application/json; charset=utf-8"}
+        self._compression = {"level": 6,
+                             "min_size": 1024,
+                             "encodings": ("gzip", "deflate")}
         self._not_implemented = not_implemented
+        self._cache = None
+        self._batch_uri = "/_batch"
+        self._metrics = Metrics()
+        self._metrics_uri = None # Served once set_metrics_uri sets it
+        self._traces_uri = None # Served once set_tracing enables tracing
+        self._profiling = None
+        self._profiles = OrderedDict()
+        self._profiles_lock = threading.Lock()
+        self._serializer = get_serializer()
         self._base_uri = str()
 
     def __del__(self):
@@ -268,6 +611,42 @@ class App:
     def set_header(self, key, value):
         self._headers[key] = value
 
+    @property
+    def serializer(self):
+        return self._serializer
+
+    def set_serializer(self, serializer=None):
+        """
+        Sets the serializer used to encode responses and decode requests.
+
+        :param serializer: name of a backend in zrest.serializers.SERIALIZERS,
+                           a serializer instance or None for the fastest
+                           installed backend.
+
+        """
+        if serializer is None or isinstance(serializer, str):
+            serializer = get_serializer(serializer)
+        self._serializer = serializer
+
+    @property
+    def compression(self):
+        return self._compression
+
+    def set_compression(self, level=6, min_size=1024, encodings=("gzip", "deflate")):
+        """
+        Configures compression of responses negotiated with Accept-Encoding.
+
+        :param level: zlib compression level, 1 to 9. 0 or None disables
+                      compression.
+        :param min_size: minimum size in bytes of a response to compress it.
+                         Streamed responses, as CSV, are always compressed.
+        :param encodings: accepted content codings, by preference.
+
+        """
+        self._compression = {"level": level,
+                             "min_size": min_size,
+                             "encodings": tuple(encodings)}
+
     def parse_uri(self, uri):
         """Gets the uri and returns the specified item in self_uris dictionary
 
@@ -276,30 +655,17 @@ class App:
 
         """
         parsed = urlparse(uri)
-        final_data = list()
-        final_data = list()
         path = parsed.path.strip(".")
-        for expr in self._re:
-            data = expr.match(path)
-            if data is not None:
-                final_data.append(data)
-        matched = None
-        for data in final_data:
-            if matched is None:
-                matched = data
-            elif data.re.pattern.index("(?P<") > matched.re.pattern.index("(?P<"):
-                matched = data
-            elif len(data.groupdict()) < len(matched.groupdict()):
-                matched = data
-        if matched is not None:
-            filter = matched.groupdict()
+        resolved = self._router.resolve(path)
+        if resolved is not None:
+            matched, filter = resolved
             filter.update(dict(parse_qsl(parsed.query)))
-            if data.re.pattern in self._params:
-                params = self._params[data.re.pattern]
+            if matched in self._params:
+                params = self._params[matched]
             else:
                 params = dict()
-            return {"uri":matched.re.pattern,
-                    "methods": self._uris[data.re.pattern],
+            return {"uri": matched,
+                    "methods": self._uris[matched],
                     "filter": filter,
                     "params": params}
 
@@ -340,8 +706,7 @@ class App:
         for index, suburi in enumerate(uris):
             if not suburi in self._uris:
                 self._uris[suburi] = dict(zip(ALL, [self._not_implemented for x in range(0, 5)]))
-            compilation = re.compile(suburi, re.IGNORECASE)  # May raise SyntaxError
-            self._re[compilation] = suburi
+            self._router.add(suburi)  # May raise re.error
             self._params[suburi] = prepare_params
             self._orig_uri[suburi] = uri
             self._name_by_uri[suburi] = name
@@ -352,9 +717,34 @@ class App:
         print("Set Model {}".format(name))
         if name not in self._simple_uri_by_name:
             self._simple_uri_by_name[name] = list()
+            self._link_templates[name] = list()
         self._simple_uri_by_name[name].append(uri)
+        self._link_templates[name].insert(0, LinkTemplate(uri)) # Latest uri wins
+        self._location_params.clear()
         return final_uri
 
+    def _get_location_params(self, uri):
+        """
+        Gives, for each param of an uri, the field of the payload it is taken
+        from and the name of the embedded model holding it, if any.
+
+        :param uri: uri as given by parse_uri
+        :returns: list of tuples with param, field and model name
+
+        """
+        if uri not in self._location_params:
+            location_params = list()
+            for param in self._params.get(uri, dict()):
+                s_param = param[1:-1]
+                named = str()
+                for name in self._models:
+                    if s_param.startswith(name+"_") and len(s_param) > len(name+"_"):
+                        s_param = s_param[len(name+"_"):]
+                        named = name
+                location_params.append((param, s_param, named))
+            self._location_params[uri] = location_params
+        return self._location_params[uri]
+
     def set_method(self, name, uri, verb, method=None):
         """
         Extends the application of a model in the specified URI
@@ -387,20 +777,250 @@ class App:
             method = model.__getattribute__(method)
         self._uris[final_uri][verb] = method
 
-    def action(self, verb, uri, **kwargs):
+    def get_version(self, parsed, verb=GET):
+        """
+        Gives the version of the data served by a parsed uri and verb, if
+        its method belongs to a model which keeps track of its changes.
+
+        :param parsed: dictionary given by parse_uri
+        :param verb: verb of the request
+        :returns: version as str or None if unknown
+
+        """
+        model = self._route_model(parsed, verb)
+        if model is None or not hasattr(model, "get_version"):
+            return None
+        return model.get_version()
+
+    def ingest(self, uri, lines, batch_size=1000):
+        """
+        Loads records in batches through the LOAD method of uri, so they are
+        never held in memory all at once.
+
+        :param uri: uri requested, with query
+        :param lines: iterable of json encoded records, one per item
+        :param batch_size: records given to the model each time
+        :returns: generator of dictionaries with the result of each batch:
+                  "batch", "records", "invalid", "response" and "payload",
+                  followed by a summary with "batches", "records", "invalid"
+                  and "errors".
+
+        """
+        summary = {"batches": 0, "records": 0, "invalid": 0, "errors": 0}
+        batch = list()
+        invalid = 0
+        lines = iter(lines)
+        while True:
+            line = next(lines, None)
+            if line is not None and line.strip():
+                try:
+                    batch.append(self.serializer.decode(line))
+                except ValueError:
+                    invalid += 1
+            if batch and (len(batch) >= batch_size or line is None):
+                result = self.action(LOAD, uri, data=batch)
+                response = result["response"] or 201
+                summary["batches"] += 1
+                summary["records"] += len(batch)
+                summary["invalid"] += invalid
+                if response >= 400:
+                    summary["errors"] += 1
+                yield {"batch": summary["batches"],
+                       "records": len(batch),
+                       "invalid": invalid,
+                       "response": response,
+                       "payload": result["payload"] if response >= 400 else None}
+                batch = list()
+                invalid = 0
+            if line is None:
+                break
+        summary["invalid"] += invalid
+        yield summary
+
+    def export(self, uri):
+        """
+        Gives every item served by GET uri, without pages, if the model of
+        the uri can export them, reading its data once.
+
+        :param uri: uri requested, with query
+        :returns: iterator of dictionaries or None if not supported
+
+        """
+        parsed = self.parse_uri(uri)
+        if parsed is None:
+            return None
+        model = self._route_model(parsed, GET)
+        if model is None or not hasattr(model, "export"):
+            return None
+        filter = dict(parsed["filter"])
+        for key in ("_item", "page", "items_per_page"):
+            if key in filter:
+                del(filter[key])
+        return model.export(filter)
+
+    def _route_model(self, parsed, verb):
+        """
+        Gives the model of a parsed uri if the method assigned to verb is
+        one of its own, None otherwise.
+
+        """
+        method = parsed["methods"][verb]
+        model = getattr(method, "__self__", None)
+        if model is None or model is not self._models.get(self._name_by_uri[parsed["uri"]]):
+            return None
+        return model
+
+    def _related_names(self, name):
+        """
+        Gives the names of the models whose data is served by the model named
+        name, itself included, as the foreign and child of a ShelveForeign.
+
+        """
+        names = {name}
+        model = self._models.get(name)
+        for related in (getattr(model, "foreign", None), getattr(model, "child", None)):
+            if related is not None:
+                names |= {item for item in self._models if self._models[item] is related}
+        return names
+
+    def set_cache(self, max_entries=1024, max_bytes=64*1024*1024):
+        """
+        Enables a cache of GET responses of models which are cacheable and
+        give a version. Cached responses are dropped when any model they
+        depend on is written through the app, or when the version of the
+        model changes.
+
+        :param max_entries: maximum amount of responses kept. If 0 or None
+                            the cache is disabled.
+        :param max_bytes: maximum size in bytes of responses kept
+
+        """
+        if max_entries:
+            self._cache = ResponseCache(max_entries, max_bytes)
+        else:
+            self._cache = None
+
+    def get_cache_stats(self):
+        """
+        Gives counters of the response cache: hits, misses, hit_ratio, entries,
+        bytes, evictions and invalidations.
+
+        :returns: dictionary with counters. Empty if cache is disabled.
+
+        """
+        if self._cache is None:
+            return dict()
+        return self._cache.stats
+
+    @staticmethod
+    def _cache_key(uri):
+        parsed = urlparse(uri)
+        query = sorted(parse_qsl(parsed.query))
+        return "{}?{}".format(parsed.path.strip("."), "&".join(["=".join(item) for item in query]))
+
+    @staticmethod
+    def _etag_matches(if_none_match, etag):
+        """
+        Compares the header If-None-Match with an ETag. Tags with the
+        content coding appended by the Handler match their uncompressed tag.
+
+        """
+        if if_none_match.strip() == "*":
+            return True
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            for encoding in ("-gzip", "-deflate"):
+                if tag.endswith(encoding):
+                    tag = tag[:-len(encoding)]
+            if '"{}"'.format(tag) == etag:
+                return True
+        return False
+
+    def action(self, verb, uri, headers=None, **kwargs):
+        """
+        Decides how to show requested query.
+
+        :param verb: verb of the request
+        :param uri: uri requested, with query
+        :param headers: headers of the request. Used to answer conditional
+                        requests and to authorize profiling. None by default.
+        :param kwargs: given to the method of the model, as data.
+        :returns: dictionary with "response", "headers" and "payload"
+
+        """
+        if self._profiling is not None and headers is not None and self._profiling_authorized(headers):
+            if verb == GET and self._profiling["uri"] is not None:
+                path = urlparse(uri).path.rstrip("/")
+                if path == self._profiling["uri"]:
+                    with self._profiles_lock:
+                        ids = list(reversed(self._profiles))
+                    return {"response": 200, "headers": dict(), "payload": {"profiles": ids}}
+                elif path.startswith(self._profiling["uri"]+"/"):
+                    profile = self.get_profile(path[len(self._profiling["uri"])+1:])
+                    if profile is None:
+                        return {"response": 404, "headers": dict(), "payload": {"Error": 404}}
+                    return {"response": 200, "headers": dict(), "payload": profile}
+            return self._profile(verb, uri, headers, **kwargs)
+        return self._action(verb, uri, headers, **kwargs)
+
+    def _action(self, verb, uri, headers=None, **kwargs):
+        if verb == POST and self._batch_uri is not None and urlparse(uri).path == self._batch_uri:
+            self._metrics.set_route(self._batch_uri)
+            return self.batch(kwargs.get("data"))
+        if verb == GET and self._traces_uri is not None and urlparse(uri).path == self._traces_uri:
+            self._metrics.set_route(self._traces_uri)
+            query = dict(parse_qsl(urlparse(uri).query))
+            try:
+                traces = tracer.get_traces(int(query["limit"]) if "limit" in query else None,
+                                           float(query.get("min_duration", 0)))
+            except ValueError:
+                return {"response": 400, "headers": dict(), "payload": {"Error": 400}}
+            return {"response": 200, "headers": dict(), "payload": {"traces": traces}}
+        if verb == GET and self._metrics_uri is not None and urlparse(uri).path == self._metrics_uri:
+            self._metrics.set_route(self._metrics_uri)
+            return {"response": 200,
+                    "headers": {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+                    "payload": self._metrics.render({"zrest_server": self.get_server_stats(),
+                                                     "zrest_cache": self.get_cache_stats()}).encode("utf-8")}
         final = {"response": 0, # 0 is decided by do_X of the Handler
                  "headers": dict(),
                  "payload": str()
                  }
-        parsed = self.parse_uri(uri)
+        with self._phase("parse_uri"):
+            parsed = self.parse_uri(uri)
         if parsed is None:
-            print("None parsing this: ", parsed)
-        if verb != NEXT and "_item" in parsed["filter"]:
-            del(parsed["filter"]["_item"])
+            print("None parsing this: ", uri)
+        else:
+            self._metrics.set_route(parsed["uri"])
+            if verb != NEXT and "_item" in parsed["filter"]:
+                del(parsed["filter"]["_item"])
         items_per_page = 50
+        cache = None
+        if parsed and verb == GET:
+            version = self.get_version(parsed)
+            if version is not None:
+                etag = '"{}"'.format(version)
+                final["headers"]["ETag"] = etag
+                if (headers is not None and headers.get("If-None-Match") is not None and
+                        self._etag_matches(headers.get("If-None-Match"), etag)):
+                    final["response"] = 304
+                    return final
+            model = self._route_model(parsed, verb)
+            if (self._cache is not None and version is not None and
+                    getattr(model, "cacheable", False) is True): # Other writes would not be seen
+                cache = {"key": self._cache_key(uri),
+                         "version": version,
+                         "generation": self._cache.generation}
+                cached = self._cache.get(cache["key"], version)
+                if cached is not None:
+                    return cached
+        elif parsed and verb in (POST, PUT, PATCH, DELETE, LOAD) and self._cache is not None:
+            self._cache.invalidate(self._related_names(self._name_by_uri[parsed["uri"]]))
         if parsed:
-            kwargs.update({"filter": parsed["filter"]})
-            kwargs["filter"] = json.dumps(kwargs["filter"])
+            filter = parsed["filter"]
             payload = None
             page = 1
             next = 1
@@ -412,155 +1032,550 @@ class App:
             if parsed is None:
                 final["response"] = 404
             else:
-                final["payload"] = parsed["methods"][verb](**kwargs)
-                if final["payload"]:
-                    payload = json.loads(final["payload"])
-                params = parsed["params"]
-                if not payload:
-                    print(parsed["methods"][verb])
-                #if (len(payload["data"]) == 1 and "_embedded" in payload["data"][0]):  # To be changed with HAL HATEOAS
-                if ("total" in payload and payload["total"] == 1 and isinstance(payload["data"], list) and
-                        len(payload["data"]) > 0):
-                    payload = payload["data"][0]
-                elif ("total" in payload and payload["total"] == 1 and isinstance(payload["data"], list) and
-                        len(payload["data"]) == 0):
-                    payload = payload
-                elif "total" in payload and payload["total"] == 1 and isinstance(payload["data"], dict):
-                    payload = payload["data"]
-                elif "total" in payload and payload["total"] > 1:
-                    payload = {self._name_by_uri[parsed["uri"]]: payload}
-                if "Error" in payload:
-                    final["response"] = int(payload["Error"])
-                try:
-                    keys = list(payload.keys())
-                except AttributeError:
-                    print(payload)
-                for item in keys:
-                    if item in self._simple_uri_by_name:
-                        if not "_embedded" in payload:
-                            payload["_embedded"] = dict()
-                        payload["_embedded"][item] = payload[item]
-                        del(payload[item])
-                def get_payload(payload):
-                    page = 1
-                    next = 1
-                    prev = 1
-                    last = 1
-                    first = 1
-                    total = 1
-                    pages = 1
-                    if "_embedded" in payload:
-                        for embedded in payload["_embedded"]:
-                            if "data" not in payload["_embedded"][embedded]:
-                                keys = list(payload["_embedded"][embedded].keys())
-                                payload["_embedded"][embedded]["data"] = [dict(payload["_embedded"][embedded])]
-                                for key in keys:
-                                    del(payload["_embedded"][embedded][key])
-                            for item in payload["_embedded"][embedded]["data"]:
-                                links = dict()
-                                if "/" in embedded:
-                                    subembedded = embedded.split("/")[0]
-                                else:
-                                    subembedded = embedded
-                                uris = self._simple_uri_by_name[subembedded]
-                                for uri in uris:
-                                    s_params = self._params_searcher.findall(uri)
-                                    for param in s_params:
-                                        if param.startswith("<"+subembedded+"_"):
-                                            s_param = "<"+param[len("<"+subembedded+"_"):]
-                                        else:
-                                            s_param = param
-                                        if s_param in uri and s_param in item:
-                                            uri = uri.replace("<"+param+">", str(item[s_param]))
-                                            links["self"] = {"href": uri.strip("^").strip("$")}
-                                            item["_links"] = links
-                                if "_embedded" in item:
-                                    item.update(get_payload(item)[0])
-                            if ("total" in payload["_embedded"][embedded] and
-                                    "page" in payload["_embedded"][embedded] and
-                                    "items_per_page" in payload["_embedded"][embedded]):
-                                total = payload["_embedded"][embedded]["total"]
-                                page = payload["_embedded"][embedded]["page"]
-                                items_per_page = payload["_embedded"][embedded]["items_per_page"]
-                                if total > items_per_page:
-                                    pages = ceil(total/items_per_page)
-                                    next = page+1
-                                    prev = page-1
-                                    first = 1
-                                    last = pages
-                                payload["_embedded"][embedded] = payload["_embedded"][embedded]["data"]
-                    return (payload, pages, next, prev, first, last, page)
-                payload, pages, next, prev, first, last, page = get_payload(payload)
-                #if verb == POST:
-                #if isinstance(payload, list): #To be changed with HAL HATEOAS
-                #    payload = payload[0]
-                location = self._orig_uri[parsed["uri"]]
-                location = location.strip("^").strip("$")
-                for param in params:
-                    s_param = param[1:-1]
-                    named = str()
-                    for name in self._models:
-                        if s_param.startswith(name+"_") and len(s_param) > len(name+"_"):
-                            s_param = s_param[len(name+"_"):]
-                            named = name
-                    if (payload and "_embedded" in payload and
-                                    named in payload["_embedded"]):
-                        pl = payload["_embedded"][named]
-                        if isinstance(pl, list) and len(pl) == 1:
-                            pl = pl[0].copy() #What a headache
-                        else:
-                            pl = {s_param: None}
-                    else:
-                        pl = payload
-                    if s_param in pl and pl[s_param] is not None:
-                        location = location.replace(param, str(pl[s_param]))
-                    else:
-                        location = location.replace(param, "")
-                if isinstance(payload, dict):
-                    new_filter = json.loads(kwargs["filter"])
-                    for param in parsed["params"]:
-                        if param[1:-1] in new_filter:
-                            del(new_filter[param[1:-1]])
-                    if len(new_filter) > 0:
-                        query = "?{}".format("&".join(["=".join((key, new_filter[key])) for key in new_filter]))
-                    else:
-                        query = str()
-                    #payload["_links"] = {"self": {"href": location+query}}
-                    payload["_links"] = dict()
-                    for name, item in (("first", first),
-                                       ("last", last),
-                                       ("prev", prev),
-                                       ("next", next),
-                                       ("self", page)):
-                        if name == "self":
-                            print("SELF: ", page)
-                        #if name == "self" or (item != page and item <= pages and item >= 1):
-                        new_filter.update({"page": item,
-                                           "items_per_page": items_per_page})
-                        payload["_links"].update({name: {
-                                "href": location+"?{}".format(
-                                    "&".join(["=".join((key, str(new_filter[key]))) for key in new_filter]))
-                                    }})
-                    final["headers"]["Location"] = location
-                final["payload"] = payload
+                method = parsed["methods"][verb]
+                if getattr(getattr(method, "__self__", None), "native", False) is True:
+                    kwargs["filter"] = dict(filter) # Models may change it
+                    if isinstance(kwargs.get("data"), (str, bytes, bytearray, memoryview)):
+                        kwargs["data"] = self.serializer.decode(kwargs["data"])
+                    with self._phase("model"):
+                        payload = method(native=True, **kwargs)
+                else:
+                    kwargs["filter"] = self.serializer.encode(filter).decode("utf-8")
+                    if isinstance(kwargs.get("data"), (bytes, bytearray, memoryview)):
+                        kwargs["data"] = bytes(kwargs["data"]).decode("utf-8")
+                    elif "data" in kwargs and not isinstance(kwargs["data"], str):
+                        kwargs["data"] = self.serializer.encode(kwargs["data"]).decode("utf-8")
+                    with self._phase("model"):
+                        final["payload"] = method(**kwargs)
+                    if final["payload"]:
+                        payload = self.serializer.decode(final["payload"])
+                with self._phase("hal"):
+                    self._respond(final, parsed, verb, payload)
         else:
             final = {"response": 404,  # 0 is decided by do_X of the Handler
                      "headers": dict(),
                      "payload": str()
                      }
+        if cache is not None and final["payload"] and final["response"] in (0, 200):
+            self._cache.put(cache["key"], final,
+                            self._related_names(self._name_by_uri[parsed["uri"]]),
+                            cache["version"],
+                            len(self.serializer.encode(final["payload"])),
+                            cache["generation"])
+        elif parsed and verb in (POST, PUT, PATCH, DELETE, LOAD) and self._cache is not None:
+            self._cache.invalidate(self._related_names(self._name_by_uri[parsed["uri"]]))
         return final
 
+    def set_batch_uri(self, uri="/_batch"):
+        """
+        Sets the uri where batches of operations are posted.
+
+        :param uri: path of the uri. If None, batches are disabled.
+
+        """
+        self._batch_uri = uri
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def set_metrics_uri(self, uri="/_metrics"):
+        """
+        Sets the uri where metrics of requests are given, in Prometheus
+        text format. Until it is called, metrics are recorded but not served.
+
+        :param uri: path of the uri. If None, metrics are not served, but
+                    they are still recorded.
+
+        """
+        self._metrics_uri = uri
+
+    def set_tracing(self, sample_rate=0.01, max_traces=1000, path=None, uri="/_traces"):
+        """
+        Enables tracing of a sample of requests, through App.action, the
+        writers of the models and each shelve opened. While it is enabled,
+        requests with header "X-Trace: 1" are always traced. Traced
+        responses have a header X-Trace-Id. Until it is called, tracing is
+        disabled and traces are not served.
+
+        :param sample_rate: ratio of requests traced. 0 disables tracing,
+                            along with X-Trace and the uri.
+        :param max_traces: amount of traces kept in memory
+        :param path: file where traces are appended as json lines. None by
+                     default.
+        :param uri: path of the uri giving kept traces, the latest first,
+                    filtered by the queries limit and min_duration, in
+                    milliseconds. If None, traces are not served.
+
+        """
+        tracer.configure(sample_rate, max_traces, path)
+        self._traces_uri = uri if tracer.enabled else None
+
+    def set_profiling(self, token, header="X-Profile", top=30, max_profiles=100, uri="/_profiles"):
+        """
+        Enables profiling of requests with given token in given header.
+        App.action runs with cProfile for them, waits for the writers of the
+        models included, and the top cumulative stats are stored. Their id
+        is given in the header X-Profile-Id of the response. Profiled
+        requests are run one at a time.
+
+        :param token: token authorizing profiling. If None, profiling is
+                      disabled.
+        :param header: header of requests carrying the token
+        :param top: amount of functions kept of each profile
+        :param max_profiles: amount of profiles kept in memory
+        :param uri: path of the uri giving the ids of stored profiles and,
+                    followed by "/<id>", each profile. Requests to it need
+                    the token too.
+
+        """
+        if token is None:
+            self._profiling = None
+        else:
+            self._profiling = {"token": str(token),
+                               "header": header,
+                               "top": top,
+                               "max_profiles": max_profiles,
+                               "uri": uri.rstrip("/") if uri is not None else None,
+                               "lock": threading.Lock()}
+
+    def _profiling_authorized(self, headers):
+        token = headers.get(self._profiling["header"])
+        return token is not None and hmac.compare_digest(str(token), self._profiling["token"])
+
+    def get_profile(self, id):
+        """
+        Gives a stored profile of a request.
+
+        :param id: id given in the header X-Profile-Id
+        :returns: dictionary with "id", "verb", "uri", "duration", "total_calls"
+                  and "stats", or None if not stored
+
+        """
+        with self._profiles_lock:
+            return self._profiles.get(id)
+
+    def _profile(self, verb, uri, headers, **kwargs):
+        """
+        Runs _action with cProfile and stores the top cumulative stats.
+
+        """
+        profiler = cProfile.Profile()
+        with self._profiling["lock"]: # A single profiler may be active at once
+            start = time.perf_counter()
+            final = profiler.runcall(self._action, verb, uri, headers, **kwargs)
+            duration = time.perf_counter() - start
+        stats = pstats.Stats(profiler)
+        rows = list()
+        for (filename, line, function), (primitive, calls, tottime, cumtime, callers) in stats.stats.items():
+            rows.append({"function": "{}:{}({})".format(filename, line, function),
+                         "calls": calls,
+                         "primitive_calls": primitive,
+                         "tottime": round(tottime, 6),
+                         "cumtime": round(cumtime, 6)})
+        rows.sort(key=lambda row: row["cumtime"], reverse=True)
+        id = uuid.uuid4().hex[:16]
+        with self._profiles_lock:
+            self._profiles[id] = {"id": id,
+                                  "verb": verb,
+                                  "uri": uri,
+                                  "duration": round(duration, 6),
+                                  "total_calls": stats.total_calls,
+                                  "stats": rows[:self._profiling["top"]]}
+            while len(self._profiles) > self._profiling["max_profiles"]:
+                self._profiles.popitem(last=False)
+        final = dict(final)
+        final["headers"] = dict(final["headers"])
+        final["headers"]["X-Profile-Id"] = id
+        return final
+
+    @contextmanager
+    def _phase(self, name):
+        with self._metrics.phase(name), tracer.span(name):
+            yield
+
+    def batch(self, operations):
+        """
+        Runs several operations given in a single request, in order. Each
+        operation is a dictionary with "verb", "path" and, if needed, "body".
+        Consecutive writes to the same model are given to its bulk method, if
+        it has one, so they are done in a single pass of its writer. An
+        operation with a wrong body is answered with 400 and the rest are run.
+
+        :param operations: list of operations, or its json
+        :returns: dictionary with "response", "headers" and "payload", which
+                  is a list with "response", "headers" and "payload" of
+                  each operation
+
+        """
+        final = {"response": 200,
+                 "headers": dict(),
+                 "payload": list()
+                 }
+        if isinstance(operations, (str, bytes, bytearray, memoryview)):
+            try:
+                operations = self.serializer.decode(operations)
+            except ValueError:
+                operations = None
+        if not isinstance(operations, list) or not all([isinstance(operation, dict) and
+                                                        "verb" in operation and "path" in operation
+                                                        for operation in operations]):
+            final.update({"response": 400, "payload": {"Error": 400}})
+            return final
+        operations = [self._batch_operation(operation) for operation in operations]
+        index = 0
+        while index < len(operations):
+            run = self._bulk_run(operations, index)
+            if len(run) > 1:
+                final["payload"].extend(self._bulk_action(run))
+                index += len(run)
+                continue
+            verb = str(operations[index]["verb"]).upper()
+            path = operations[index]["path"]
+            if verb not in ALL+[NEXT] or urlparse(path).path == self._batch_uri:
+                result = {"response": 405, "headers": dict(), "payload": {"Error": 405}}
+            elif "error" in operations[index]:
+                result = {"response": 400, "headers": dict(), "payload": {"Error": 400}}
+            elif verb in (POST, PUT, PATCH, LOAD):
+                result = self.action(verb, path, data=operations[index].get("body"))
+            else:
+                result = self.action(verb, path)
+            final["payload"].append(self._batch_result(verb, result))
+            index += 1
+        return final
+
+    def _batch_operation(self, operation):
+        """
+        Decodes the body of an operation of a batch, if it is given encoded.
+        POST, PUT and PATCH need a dictionary as body and LOAD needs a body,
+        so operations without them are marked with "error", as well as the
+        ones whose body can not be decoded.
+
+        :returns: copy of the operation with its body decoded
+
+        """
+        operation = dict(operation)
+        verb = str(operation["verb"]).upper()
+        body = operation.get("body")
+        if isinstance(body, (str, bytes, bytearray, memoryview)):
+            try:
+                body = self.serializer.decode(body)
+            except ValueError:
+                operation["error"] = 400
+                return operation
+            operation["body"] = body
+        if ((verb in (POST, PUT, PATCH) and not isinstance(body, dict)) or
+                (verb == LOAD and body is None)):
+            operation["error"] = 400
+        return operation
+
+    @staticmethod
+    def _batch_result(verb, result):
+        """
+        Gives the response of an operation of a batch as the Handler would.
+
+        """
+        response = result["response"]
+        if response == 0:
+            response = 201 if verb in (POST, LOAD) else 200
+        if not result["payload"] and verb in (GET, NEXT):
+            response = 404
+        return {"response": response,
+                "headers": result["headers"],
+                "payload": result["payload"]}
+
+    def _bulk_run(self, operations, start):
+        """
+        Gives the operations of a batch, from start, which can be written to
+        the same model in a single call to its bulk method.
+
+        :returns: list of tuples with verb, parsed uri, model and body
+
+        """
+        run = list()
+        for operation in operations[start:]:
+            verb = str(operation["verb"]).upper()
+            if verb not in BULK_ACTIONS or "error" in operation:
+                break
+            parsed = self.parse_uri(operation["path"])
+            if parsed is None:
+                break
+            model = self._route_model(parsed, verb)
+            if (model is None or not callable(getattr(model, "bulk", None)) or
+                    parsed["methods"][verb] != getattr(model, verb.lower()) or
+                    (run and model is not run[0][2])):
+                break
+            if "_item" in parsed["filter"]:
+                del(parsed["filter"]["_item"])
+            run.append((verb, parsed, model, operation.get("body")))
+        return run
+
+    def _bulk_action(self, run):
+        """
+        Writes a run of operations given by _bulk_run through the bulk method
+        of their model, and builds their responses as action does.
+
+        :returns: list with "response", "headers" and "payload" of each
+                  operation
+
+        """
+        model = run[0][2]
+        names = self._related_names(self._name_by_uri[run[0][1]["uri"]])
+        if self._cache is not None:
+            self._cache.invalidate(names)
+        operations = list()
+        for verb, parsed, model, body in run:
+            operations.append((BULK_ACTIONS[verb], dict(parsed["filter"]), body if body is not None else dict()))
+        results = list()
+        with self._phase("model"):
+            payloads = model.bulk(operations)
+        for (verb, parsed, model, body), payload in zip(run, payloads):
+            final = {"response": 0,
+                     "headers": dict(),
+                     "payload": str()
+                     }
+            with self._phase("hal"):
+                self._respond(final, parsed, verb, model._return(payload, native=True))
+            results.append(self._batch_result(verb, final))
+        if self._cache is not None:
+            self._cache.invalidate(names)
+        return results
+
+    def _respond(self, final, parsed, verb, payload):
+        """
+        Builds the HAL document of the payload given by a model and sets it
+        in final, with its Location.
+
+        :param final: dictionary to be returned by action
+        :param parsed: dictionary given by parse_uri
+        :param verb: verb of the request
+        :param payload: data given by the model
+
+        """
+        filter = parsed["filter"]
+        items_per_page = 50
+        if not payload:
+            print(parsed["methods"][verb])
+        #if (len(payload["data"]) == 1 and "_embedded" in payload["data"][0]):  # To be changed with HAL HATEOAS
+        if ("total" in payload and payload["total"] == 1 and isinstance(payload["data"], list) and
+                len(payload["data"]) > 0):
+            payload = payload["data"][0]
+        elif ("total" in payload and payload["total"] == 1 and isinstance(payload["data"], list) and
+                len(payload["data"]) == 0):
+            payload = payload
+        elif "total" in payload and payload["total"] == 1 and isinstance(payload["data"], dict):
+            payload = payload["data"]
+        elif "total" in payload and payload["total"] > 1:
+            payload = {self._name_by_uri[parsed["uri"]]: payload}
+        if "Error" in payload:
+            final["response"] = int(payload["Error"])
+        try:
+            keys = list(payload.keys())
+        except AttributeError:
+            print(payload)
+        for item in keys:
+            if item in self._simple_uri_by_name:
+                if not "_embedded" in payload:
+                    payload["_embedded"] = dict()
+                payload["_embedded"][item] = payload[item]
+                del(payload[item])
+        def get_payload(payload):
+            page = 1
+            next = 1
+            prev = 1
+            last = 1
+            first = 1
+            total = 1
+            pages = 1
+            if "_embedded" in payload:
+                for embedded in payload["_embedded"]:
+                    if "data" not in payload["_embedded"][embedded]:
+                        keys = list(payload["_embedded"][embedded].keys())
+                        payload["_embedded"][embedded]["data"] = [dict(payload["_embedded"][embedded])]
+                        for key in keys:
+                            del(payload["_embedded"][embedded][key])
+                    for item in payload["_embedded"][embedded]["data"]:
+                        links = dict()
+                        if "/" in embedded:
+                            subembedded = embedded.split("/")[0]
+                        else:
+                            subembedded = embedded
+                        for template in self._link_templates[subembedded]:
+                            href = template.expand(item)
+                            if href is not None:
+                                links["self"] = {"href": href}
+                                item["_links"] = links
+                                break
+                        if "_embedded" in item:
+                            item.update(get_payload(item)[0])
+                    if ("total" in payload["_embedded"][embedded] and
+                            "page" in payload["_embedded"][embedded] and
+                            "items_per_page" in payload["_embedded"][embedded]):
+                        total = payload["_embedded"][embedded]["total"]
+                        page = payload["_embedded"][embedded]["page"]
+                        items_per_page = payload["_embedded"][embedded]["items_per_page"]
+                        if total > items_per_page:
+                            pages = ceil(total/items_per_page)
+                            next = page+1
+                            prev = page-1
+                            first = 1
+                            last = pages
+                        payload["_embedded"][embedded] = payload["_embedded"][embedded]["data"]
+            return (payload, pages, next, prev, first, last, page)
+        payload, pages, next, prev, first, last, page = get_payload(payload)
+        #if verb == POST:
+        #if isinstance(payload, list): #To be changed with HAL HATEOAS
+        #    payload = payload[0]
+        location = self._orig_uri[parsed["uri"]]
+        location = location.strip("^").strip("$")
+        for param, s_param, named in self._get_location_params(parsed["uri"]):
+            if (payload and "_embedded" in payload and
+                            named in payload["_embedded"]):
+                pl = payload["_embedded"][named]
+                if isinstance(pl, list) and len(pl) == 1:
+                    pl = pl[0].copy() #What a headache
+                else:
+                    pl = {s_param: None}
+            else:
+                pl = payload
+            if s_param in pl and pl[s_param] is not None:
+                location = location.replace(param, str(pl[s_param]))
+            else:
+                location = location.replace(param, "")
+        if isinstance(payload, dict):
+            new_filter = dict(filter)
+            for param in parsed["params"]:
+                if param[1:-1] in new_filter:
+                    del(new_filter[param[1:-1]])
+            if len(new_filter) > 0:
+                query = "?{}".format("&".join(["=".join((key, new_filter[key])) for key in new_filter]))
+            else:
+                query = str()
+            #payload["_links"] = {"self": {"href": location+query}}
+            payload["_links"] = dict()
+            for name, item in (("first", first),
+                               ("last", last),
+                               ("prev", prev),
+                               ("next", next),
+                               ("self", page)):
+                #if name == "self" or (item != page and item <= pages and item >= 1):
+                new_filter.update({"page": item,
+                                   "items_per_page": items_per_page})
+                payload["_links"].update({name: {
+                        "href": location+"?{}".format(
+                            "&".join(["=".join((key, str(new_filter[key]))) for key in new_filter]))
+                            }})
+            final["headers"]["Location"] = location
+        final["payload"] = payload
+
     def set_ssl(self, key, cert):
         assert os.path.exists(key)
         assert os.path.exists(cert)
         self._key, self._cert = key, cert
 
-    def run(self, addr, port):
-        class Server(ThreadingMixIn, HTTPServer):
-            pass
+    def run(self, addr, port, workers=1, pool_size=None, queue_size=64, retry_after=1):
+        """
+        Runs application.
+
+        :param addr: address to listen to
+        :param port: port to listen to
+        :param workers: amount of processes serving the application. If
+                        greater than 1, the listening socket is opened once
+                        and inherited by workers forked from this process.
+                        Each worker reopens the models of the app.
+        :param pool_size: amount of threads serving connections in each
+                          process. If None, a thread is started for each
+                          connection.
+        :param queue_size: connections waiting for a thread of the pool.
+                           Once full, connections are answered with
+                           503 - Service Unavailable.
+        :param retry_after: seconds sent in Retry-After header with a 503.
+
+        """
+        if pool_size is None:
+            class Server(ThreadingMixIn, HTTPServer):
+                pass
+        else:
+            class Server(ThreadPoolMixIn, HTTPServer):
+                pass
+            Server.pool_size = pool_size
+            Server.queue_size = queue_size
+            Server.retry_after = retry_after
         self._server = Server((addr, int(port)), self._handler)
         if self._key is not None and self._cert is not None:
             ssl.wrap_socket(self._server.socket, self._key, self._cert)
+        if workers > 1 and hasattr(os, "fork"):
+            self._prefork(workers)
+        else:
+            self._server.serve_forever()
+
+    def _prefork(self, workers):
+        self._stopping = False
+        for worker in range(0, workers):
+            self._fork_worker()
+        while self._workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid in self._workers:
+                self._workers.remove(pid)
+                if self._stopping is False:
+                    print("Worker {} exited with status {}. Respawning.".format(pid, status))
+                    self._fork_worker()
+        self._server.server_close()
+
+    def _fork_worker(self):
+        pid = os.fork()
+        if pid != 0:
+            self._workers.append(pid)
+            return
+        status = 0
+        try:
+            self._workers = list()
+            signal.signal(signal.SIGTERM,
+                          lambda signum, frame: threading.Thread(target=self._server.shutdown).start())
+            for model in self._models:
+                self._models[model].reopen()
+            self._server.serve_forever()
+            for model in self._models:
+                self._models[model].close()
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def get_server_stats(self):
+        """
+        Gives counters of the server running the application, as the depth
+        of the queue and the connections rejected when running with a pool.
+
+        :returns: dictionary with counters. Empty if not available.
+
+        """
+        return dict(getattr(self._server, "stats", dict()))
+
+    def run_async(self, addr, port, max_workers=None):
+        """
+        Runs application on an asyncio event loop instead of a thread per
+        connection. Requests are given to the handler in an executor of
+        max_workers threads, so the amount of connections does not grow the
+        amount of threads.
+
+        :param addr: address to listen to
+        :param port: port to listen to
+        :param max_workers: threads running the handler. Default of
+                            concurrent.futures.ThreadPoolExecutor if None.
+
+        """
+        ssl_context = None
+        if self._key is not None and self._cert is not None:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(self._cert, self._key)
+        self._server = AsyncServer((addr, int(port)), self._handler,
+                                   max_workers=max_workers,
+                                   ssl_context=ssl_context)
         self._server.serve_forever()
 
     @threadize
@@ -570,7 +1585,15 @@ class App:
     @threadize
     def _shutdown(self):
         time.sleep(0.1)
-        self._server.shutdown()
+        if self._workers:
+            self._stopping = True
+            for pid in list(self._workers): # Respawns may change it meanwhile
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        elif self._server is not None:
+            self._server.shutdown()
         for model in self._models:
             self._models[model].close()
 
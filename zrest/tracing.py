@@ -0,0 +1,234 @@
+"""
+Tracing
+
+Spans following a single request from the Handler through App.action, the
+pipe to the writer of a ShelveModel and each shelve opened, with the time
+waited for its lock. Only a sample of requests is traced. Finished traces
+are kept in a ring buffer and may also be appended to a file of json lines.
+
+The context of a trace is kept by thread, so it has to be given along with
+messages sent to other threads, as ShelveModel does through its pipe.
+
+Tracing is disabled until a sample rate is set with configure, which
+App.set_tracing does.
+"""
+from collections import deque
+from contextlib import contextmanager
+import functools
+import threading
+import random
+import json
+import time
+import uuid
+
+__all__ = ["Tracer",
+           "tracer",
+           "traced"]
+
+
+class Tracer:
+    """
+    Sampled traces of requests.
+
+    :method configure: Sets sample rate, size of the ring buffer and file.
+    :method start_trace: Starts a trace in this thread, if sampled.
+    :method finish_trace: Ends the trace of this thread and keeps it.
+    :method span: Context manager recording a span of the current trace.
+    :method add_span: Records a span already measured.
+    :method context: Gives the context of the current trace.
+    :method attach: Context manager continuing a trace in another thread.
+    :method get_traces: Gives the kept traces.
+
+    """
+    def __init__(self, sample_rate=0.0, max_traces=1000, path=None):
+        """
+        Initializes Tracer
+
+        :param sample_rate: ratio of requests traced, from 0 to 1
+        :param max_traces: amount of finished traces kept in memory
+        :param path: file where finished traces are appended as json lines.
+                     None by default.
+
+        """
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active = dict()  # trace_id: trace
+        self.configure(sample_rate, max_traces, path)
+
+    def configure(self, sample_rate=0.0, max_traces=1000, path=None):
+        with self._lock:
+            self.sample_rate = sample_rate
+            self.path = path
+            self._traces = deque(getattr(self, "_traces", list()), max_traces)
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def _current(self):
+        return getattr(self._local, "current", None)
+
+    def start_trace(self, name, force=False, **attributes):
+        """
+        Starts a trace in this thread if it is sampled.
+
+        :param name: name of the trace, as the request line
+        :param force: trace it even if it is not sampled
+        :param attributes: attributes of the trace
+        :returns: id of the trace or None if not traced
+
+        """
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            self._local.current = None
+            return None
+        trace_id = uuid.uuid4().hex[:16]
+        trace = {"trace_id": trace_id,
+                 "name": name,
+                 "timestamp": time.time(),
+                 "start": time.perf_counter(),
+                 "attributes": attributes,
+                 "spans": list()}
+        with self._lock:
+            self._active[trace_id] = trace
+        self._local.current = (trace_id, None)
+        return trace_id
+
+    def finish_trace(self, **attributes):
+        """
+        Ends the trace of this thread, keeps it in the ring buffer and
+        appends it to the file, if any.
+
+        :param attributes: attributes to add to the trace
+        :returns: dictionary with the trace or None if not traced
+
+        """
+        current = self._current()
+        self._local.current = None
+        if current is None:
+            return None
+        with self._lock:
+            trace = self._active.pop(current[0], None)
+            if trace is None:
+                return None
+            trace["attributes"].update(attributes)
+            trace["duration"] = round((time.perf_counter() - trace.pop("start")) * 1000, 3)
+            trace["spans"].sort(key=lambda span: span["start"])
+            self._traces.append(trace)
+            if self.path is not None:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps(trace, default=str) + "\n")
+        return trace
+
+    def context(self):
+        """
+        Gives the context of the current trace, to be given to other threads.
+
+        :returns: tuple with trace id and parent span id or None if not traced
+
+        """
+        return self._current()
+
+    @contextmanager
+    def attach(self, context):
+        """
+        Continues in this thread the trace of given context.
+
+        :param context: tuple given by context or None
+
+        """
+        previous = self._current()
+        self._local.current = context
+        try:
+            yield
+        finally:
+            self._local.current = previous
+
+    def add_span(self, name, start, end, context=None, **attributes):
+        """
+        Records a span already measured.
+
+        :param name: name of the span
+        :param start: time.perf_counter() at its start
+        :param end: time.perf_counter() at its end
+        :param context: context of the trace. The one of this thread if None.
+        :param attributes: attributes of the span
+        :returns: id of the span or None if not traced
+
+        """
+        if context is None:
+            context = self._current()
+        if context is None:
+            return None
+        span_id = uuid.uuid4().hex[:8]
+        self._append(context, span_id, name, start, end, attributes)
+        return span_id
+
+    def _append(self, context, span_id, name, start, end, attributes):
+        with self._lock:
+            trace = self._active.get(context[0])
+            if trace is not None:
+                trace["spans"].append({"span_id": span_id,
+                                       "parent_id": context[1],
+                                       "name": name,
+                                       "thread": threading.current_thread().name,
+                                       "start": round((start - trace["start"]) * 1000, 3),
+                                       "duration": round((end - start) * 1000, 3),
+                                       "attributes": attributes})
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Records a span of the current trace, if any, around the block.
+        Spans started inside it are its children.
+
+        :param name: name of the span
+        :param attributes: attributes of the span
+
+        """
+        context = self._current()
+        if context is None:
+            yield
+            return
+        span_id = uuid.uuid4().hex[:8]
+        self._local.current = (context[0], span_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.current = context
+            self._append(context, span_id, name, start, time.perf_counter(), attributes)
+
+    def get_traces(self, limit=None, min_duration=0):
+        """
+        Gives the kept traces, the latest first.
+
+        :param limit: maximum amount of traces. All of them if None.
+        :param min_duration: minimum duration in milliseconds
+        :returns: list of dictionaries
+
+        """
+        with self._lock:
+            traces = [trace for trace in reversed(self._traces) if trace["duration"] >= min_duration]
+        return traces[:limit] if limit is not None else traces
+
+
+tracer = Tracer()
+
+
+def traced(name):
+    """
+    Decorator recording a span of the current trace, if any, each time the
+    function is called.
+
+    :param name: name of the span
+
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if tracer._current() is None:
+                return function(*args, **kwargs)
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator